@@ -0,0 +1,92 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Recent item activity (creates, updates and deletes, see item_activity in
+database_setup.py) served from memory:
+    - ActivityFeed holds the newest rows in a bounded deque
+    - refresh() only reads the rows past the newest seq it holds, at most
+      once per interval, or right away after expire() (this process wrote)
+    - since() answers feed polls, createdItemIds() the home page's latest
+      items
+"""
+
+import time
+import threading
+
+from collections import deque
+
+from sqlalchemy import select
+
+from database_setup import activity_table, ACTIVITY_SIZE
+
+
+class ActivityFeed(object):
+    def __init__(self, size=ACTIVITY_SIZE, interval=2):
+        self.entries = deque(maxlen=size)
+        self.last_seq = 0
+        self.interval = interval
+        self.next_refresh = 0
+        self.lock = threading.Lock()
+
+    def expire(self):
+        # The next refresh() reads the database whatever the interval
+        with self.lock:
+            self.next_refresh = 0
+
+    def refresh(self, bind):
+        """
+        Appends the rows newer than the newest one held, one range read on
+        the seq primary key. Returns the newest seq held.
+        """
+        with self.lock:
+            if time.time() < self.next_refresh:
+                return self.last_seq
+            self.next_refresh = time.time() + self.interval
+            last_seq = self.last_seq
+
+        rows = bind.execute(select([activity_table]).where(
+                    activity_table.c.seq > last_seq).order_by(
+                    activity_table.c.seq.desc()).limit(
+                    self.entries.maxlen)).fetchall()
+        with self.lock:
+            for row in reversed(rows):
+                # Another thread may have appended it meanwhile
+                if row.seq > self.last_seq:
+                    self.entries.append(dict(row))
+                    self.last_seq = row.seq
+            return self.last_seq
+
+    def since(self, seq, limit):
+        """
+        Returns (up to limit entries after seq oldest first, truncated).
+        truncated is True when entries after seq may no longer be held,
+        the client should resync in full.
+        """
+        with self.lock:
+            entries = list(self.entries)
+        truncated = bool(entries) and seq < entries[0]['seq'] - 1
+        return [entry for entry in entries
+                if entry['seq'] > seq][:limit], truncated
+
+    def latest(self, limit):
+        # Newest entries first
+        with self.lock:
+            entries = list(self.entries)
+        return entries[:-limit - 1:-1] if limit else []
+
+    def createdItemIds(self, limit):
+        # Ids of the newest created items not deleted since, newest first
+        with self.lock:
+            entries = list(self.entries)
+        deleted = set()
+        created = []
+        for entry in reversed(entries):
+            if entry['action'] == 'delete':
+                deleted.add(entry['item_id'])
+            elif entry['action'] == 'create' and \
+                    entry['item_id'] not in deleted:
+                created.append(entry['item_id'])
+                if len(created) == limit:
+                    break
+        return created
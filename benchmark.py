@@ -0,0 +1,240 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Load benchmark: drives every page and JSON endpoint through Flask's test
+client (in process, so only app + database time is measured) and reports
+p50/p95/p99 latency and throughput per route.
+
+Usage (seed the database first, e.g. with seed_data.py):
+    python benchmark.py --requests 200
+    python benchmark.py --database-url sqlite:///bench.db --compare \\
+        benchmarks/<older commit>.json
+Results are saved as benchmarks/<commit>.json for comparison.
+
+It also times importing database_setup and catalog in fresh interpreters
+(worker boot time) against IMPORT_BUDGETS_MS, and exits with status 1 if
+a median is over its budget.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import subprocess
+
+RESULTS_DIR = 'benchmarks'
+# Median import time budgets (ms), neither import may touch the database
+IMPORT_BUDGETS_MS = {'database_setup': 400, 'catalog': 1000}
+IMPORT_SNIPPET = ("import time; start = time.time(); import %s; "
+                  "print (time.time() - start) * 1000")
+
+
+def percentile(ordered, pct):
+    # Nearest rank percentile of an already sorted list
+    if not ordered:
+        return None
+    rank = max(int(round(pct / 100.0 * len(ordered))), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def gitCommit():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                    ['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                    stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def importTimes(runs):
+    """
+    Imports each module of IMPORT_BUDGETS_MS runs times, each in a new
+    interpreter, returns {module: {median_ms, max_ms, budget_ms}}.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+                    filter(None, [here, env.get('PYTHONPATH')]))
+    times = {}
+    for module in sorted(IMPORT_BUDGETS_MS):
+        samples = sorted(float(subprocess.check_output(
+                            [sys.executable, '-c', IMPORT_SNIPPET % module],
+                            env=env).split()[-1])
+                         for _ in range(runs))
+        times[module] = {'median_ms': round(percentile(samples, 50), 1),
+                         'max_ms': round(samples[-1], 1),
+                         'budget_ms': IMPORT_BUDGETS_MS[module]}
+    return times
+
+
+def sampleRoutes(catalog):
+    """
+    The routes to drive, filled in with real names: the biggest category
+    (hot) and a small one (cold), and an item of each.
+    """
+    from sqlalchemy import func
+    from database_setup import Category, Item
+
+    session = catalog.session
+    sizes = session.query(Category.name, func.count(Item.id)).outerjoin(
+                    Category.items).group_by(Category.id,
+                                             Category.name).order_by(
+                    func.count(Item.id).desc(), Category.id).all()
+    if not sizes:
+        sys.exit("Empty catalog, seed it first (seed_data.py)")
+
+    routes = [('catalogHome', '/'), ('catalogHomeFull', '/catalog/full/'),
+              ('getUsers', '/users/'), ('catalogJSON', '/catalog.json'),
+              ('categoriesJSON', '/categories.json'),
+              ('categoriesJSON (paged)', '/categories.json?limit=50'),
+              ('itemsJSON', '/items.json'),
+              ('itemsJSON (paged)', '/items.json?limit=50'),
+              ('usersJSON', '/users.json'), ('rolesJSON', '/roles.json'),
+              ('loginTypesJSON', '/login-types.json')]
+
+    for label, (name, size) in (('hot', sizes[0]), ('cold', sizes[-1])):
+        routes.extend([
+            ('categoryInfo (%s)' % label, '/catalog/%s/' % name),
+            ('categItems (%s)' % label, '/catalog/%s/items/' % name),
+            ('singleCategJSON (%s)' % label, '/catalog/%s/json/' % name),
+            ('singleCategItemsJSON (%s)' % label,
+             '/catalog/%s/items/json/' % name)])
+        item = session.query(Item.name).join(Item.category).filter(
+                    Category.name == name).order_by(Item.id).first()
+        if item is not None:
+            routes.extend([
+                ('itemInfo (%s)' % label,
+                 '/catalog/%s/%s/' % (name, item.name)),
+                ('singleItemJSON (%s)' % label,
+                 '/catalog/%s/%s/json/' % (name, item.name))])
+    session.remove()
+    return routes
+
+
+def run(client, url, requests, warmup):
+    for _ in range(warmup):
+        client.get(url).close()
+
+    timings = []
+    errors = 0
+    started = time.time()
+    for _ in range(requests):
+        start = time.time()
+        response = client.get(url)
+        # Streamed responses only do their work while being read
+        response.get_data()
+        timings.append((time.time() - start) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+        response.close()
+    elapsed = time.time() - started
+
+    timings.sort()
+    return {
+        'url': url,
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(timings[-1], 3),
+        'rps': round(requests / elapsed, 1) if elapsed else None
+    }
+
+
+def report(results, baseline=None):
+    print "%-34s %9s %9s %9s %8s %s" % (
+                'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s',
+                'p95 vs base' if baseline else '')
+    for name in sorted(results):
+        stats = results[name]
+        delta = ''
+        base = (baseline or {}).get(name)
+        if base and base['p95_ms']:
+            delta = '%+.1f%%' % ((stats['p95_ms'] - base['p95_ms']) /
+                                 base['p95_ms'] * 100)
+        print "%-34s %9.3f %9.3f %9.3f %8.1f %s" % (
+                    name[:34], stats['p50_ms'], stats['p95_ms'],
+                    stats['p99_ms'], stats['rps'], delta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Catalog App")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="timed requests per route")
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--database-url',
+                        help="defaults to CATALOG_DATABASE_URL / DATABASE")
+    parser.add_argument('--login', metavar='EMAIL',
+                        help="benchmark as this (google) user")
+    parser.add_argument('--only', help="only routes containing this text")
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help="fresh interpreter imports timed per module, "
+                             "0 to skip")
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help="earlier results file to compare against")
+    parser.add_argument('--output', help="defaults to "
+                        "benchmarks/<commit>.json, '-' to not save")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        os.environ['CATALOG_DATABASE_URL'] = args.database_url
+
+    startup = {}
+    over_budget = False
+    if args.startup_runs:
+        startup = importTimes(args.startup_runs)
+        for module in sorted(startup):
+            times = startup[module]
+            over = times['median_ms'] > times['budget_ms']
+            over_budget = over_budget or over
+            print "import %-24s %9.1f ms median (budget %d ms)%s" % (
+                        module, times['median_ms'], times['budget_ms'],
+                        ' OVER BUDGET' if over else '')
+
+    # Imported late, the engine is created from the environment
+    import catalog
+
+    catalog.app.secret_key = catalog.app.secret_key or 'benchmark'
+    client = catalog.app.test_client()
+    if args.login:
+        with client.session_transaction() as login_session:
+            login_session['email'] = args.login
+            login_session['login_type'] = 'google'
+
+    results = {}
+    for name, url in sampleRoutes(catalog):
+        if args.only and args.only not in name:
+            continue
+        results[name] = run(client, url, args.requests, args.warmup)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+
+    commit = gitCommit()
+    output = args.output or os.path.join(RESULTS_DIR, '%s.json' % commit)
+    if output != '-':
+        if not os.path.isdir(os.path.dirname(output) or '.'):
+            os.makedirs(os.path.dirname(output))
+        with open(output, 'w') as f:
+            json.dump({'commit': commit,
+                       'date': datetime.datetime.utcnow().isoformat(),
+                       'database': catalog.engine.dialect.name,
+                       'requests': args.requests,
+                       'login': bool(args.login),
+                       'startup': startup,
+                       'results': results}, f, indent=2, sort_keys=True)
+        print "Saved %s" % output
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Bulk import/export of categories and items:
+    - NDJSON, one record per line:
+        {"type": "category", "name": ..., "description": ...}
+        {"type": "item", "category": ..., "name": ..., "description": ...}
+    - CSV with a header row: type,category,name,description
+Imports upsert (categories on name, items on the categ_itemname
+constraint), in batches, resolving category names once per batch. On
+PostgreSQL items are loaded with COPY into a temp table and upserted
+from there.
+
+Usage:
+    python bulk.py import catalog.ndjson [--format csv]
+    python bulk.py export [--format csv] > catalog.ndjson
+"""
+
+import sys
+import csv
+import json
+import argparse
+
+from cStringIO import StringIO
+
+from sqlalchemy import select, bindparam, func, and_, or_, case
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql
+
+from database_setup import (Category, Item, getEngine, refreshItemCounts,
+                            recordBulkActivity, logBulkChanges)
+
+FIELDS = ('type', 'category', 'name', 'description')
+BATCH_SIZE = 5000
+
+category_table = Category.__table__
+item_table = Item.__table__
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+"""
+Parsing / Formatting
+"""
+
+
+def _text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+
+def parseNDJSON(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise BulkImportError("Line %d is not valid JSON" % number)
+
+
+def parseCSV(lines):
+    for record in csv.DictReader(lines):
+        yield dict((key, _text(value)) for key, value in record.items())
+
+
+def formatNDJSON(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def formatCSV(records):
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow([(record.get(field) or u'').encode('utf-8')
+                         for field in FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+PARSERS = {'ndjson': parseNDJSON, 'csv': parseCSV}
+FORMATTERS = {'ndjson': formatNDJSON, 'csv': formatCSV}
+
+
+"""
+Import
+"""
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _upsertCategories(connection, categories, user_id):
+    # categories: {name: description}
+    if not categories:
+        return
+    rows = [{'name': name, 'description': desc, 'created_by': user_id}
+            for name, desc in categories.items()]
+
+    if connection.dialect.name == 'postgresql':
+        stmt = postgresql.insert(category_table)
+        connection.execute(stmt.on_conflict_do_update(
+                    index_elements=['name'],
+                    set_={'description': stmt.excluded.description,
+                          'last_update_by': stmt.excluded.created_by,
+                          'updated': func.now()}), rows)
+        return
+
+    existing = set(name for name, in connection.execute(
+                    select([category_table.c.name]).where(
+                        category_table.c.name.in_(list(categories)))))
+    inserts = [row for row in rows if row['name'] not in existing]
+    updates = [{'_name': row['name'], 'description': row['description'],
+                'last_update_by': user_id}
+               for row in rows if row['name'] in existing]
+    if inserts:
+        connection.execute(category_table.insert(), inserts)
+    if updates:
+        connection.execute(category_table.update().where(
+                    category_table.c.name == bindparam('_name')).values(
+                    updated=func.now()), updates)
+
+
+def _resolveCategories(connection, names, known):
+    # Adds {name: id} for any of names not yet in known, one SELECT
+    missing = [name for name in names if name not in known]
+    if missing:
+        known.update(connection.execute(
+                    select([category_table.c.name, category_table.c.id]).
+                    where(category_table.c.name.in_(missing))).fetchall())
+
+
+def _copyUpsertItems(connection, rows):
+    # PostgreSQL: COPY the batch into a temp table, then upsert from it
+    cursor = connection.connection.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS item_import "
+                   "(category_id integer, name varchar(80), "
+                   "description text, created_by integer) "
+                   "ON COMMIT DELETE ROWS")
+    buf = StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row['category_id'], row['name'].encode('utf-8'),
+                         row['description'].encode('utf-8'),
+                         '' if row['created_by'] is None
+                         else row['created_by']])
+    buf.seek(0)
+    cursor.copy_expert("COPY item_import (category_id, name, description, "
+                       "created_by) FROM STDIN WITH (FORMAT csv)", buf)
+    cursor.execute("INSERT INTO item (category_id, name, description, "
+                   "created_by) "
+                   "SELECT category_id, name, description, created_by "
+                   "FROM item_import "
+                   "ON CONFLICT ON CONSTRAINT categ_itemname DO UPDATE SET "
+                   "description = EXCLUDED.description, "
+                   "last_update_by = EXCLUDED.created_by, updated = now()")
+    cursor.execute("TRUNCATE item_import")
+    cursor.close()
+
+
+def _upsertItems(connection, items, user_id):
+    # items: {(category_id, name): description}
+    if not items:
+        return
+    rows = [{'category_id': categ_id, 'name': name, 'description': desc,
+             'created_by': user_id}
+            for (categ_id, name), desc in items.items()]
+
+    if connection.dialect.name == 'postgresql':
+        _copyUpsertItems(connection, rows)
+        return
+
+    existing = set()
+    for categ_id in set(row['category_id'] for row in rows):
+        names = [row['name'] for row in rows
+                 if row['category_id'] == categ_id]
+        existing.update((categ_id, name) for name, in connection.execute(
+                    select([item_table.c.name]).where(and_(
+                        item_table.c.category_id == categ_id,
+                        item_table.c.name.in_(names)))))
+    inserts = [row for row in rows
+               if (row['category_id'], row['name']) not in existing]
+    updates = [{'_categ': row['category_id'], '_name': row['name'],
+                'description': row['description'],
+                'last_update_by': user_id}
+               for row in rows
+               if (row['category_id'], row['name']) in existing]
+    if inserts:
+        connection.execute(item_table.insert(), inserts)
+    if updates:
+        connection.execute(item_table.update().where(and_(
+                    item_table.c.category_id == bindparam('_categ'),
+                    item_table.c.name == bindparam('_name'))).values(
+                    updated=func.now()), updates)
+
+
+def _logItemChanges(connection, items, user_id):
+    # items: {(category_id, name): description}, logged for sync clients
+    # and the activity feed. Inserted items have no updated time yet,
+    # upserted ones just got one.
+    if not items:
+        return
+    names = {}
+    for categ_id, name in items:
+        names.setdefault(categ_id, []).append(name)
+    criterion = or_(*[and_(item_table.c.category_id == categ_id,
+                           item_table.c.name.in_(categ_names))
+                      for categ_id, categ_names in names.items()])
+    logBulkChanges(connection, 'item', 'upsert', criterion)
+    recordBulkActivity(connection,
+                       case([(item_table.c.updated.is_(None), 'create')],
+                            else_='update'),
+                       criterion, user_id)
+
+
+def importRecords(session, records, user_id=None, batch_size=BATCH_SIZE):
+    """
+    Upserts category/item records in batches on the session's connection,
+    the caller commits. Returns {'categories': n, 'items': n}, records
+    are counted once per batch they appear in (the last one wins).
+    """
+    connection = session.connection()
+    known = {}
+    stats = {'categories': 0, 'items': 0}
+
+    for number, batch in enumerate(_batches(records, batch_size)):
+        categories = {}
+        items = {}
+        for record in batch:
+            kind = record.get('type')
+            name = record.get('name')
+            desc = record.get('description') or u''
+            if not name:
+                raise BulkImportError("Record without a name in batch %d"
+                                      % number)
+            if kind == 'category':
+                categories[name] = desc
+            elif kind == 'item':
+                if not record.get('category'):
+                    raise BulkImportError("Item '%s' has no category" % name)
+                items[(record['category'], name)] = desc
+            else:
+                raise BulkImportError("Unknown record type '%s'" % kind)
+
+        _upsertCategories(connection, categories, user_id)
+        if categories:
+            logBulkChanges(connection, 'category', 'upsert',
+                           category_table.c.name.in_(list(categories)))
+        stats['categories'] += len(categories)
+        # Categories just upserted may have new ids
+        for name in categories:
+            known.pop(name, None)
+
+        _resolveCategories(connection,
+                           set(categ for categ, name in items), known)
+        resolved = {}
+        for (categ, name), desc in items.items():
+            if categ not in known:
+                raise BulkImportError("Unknown category '%s' for item '%s'"
+                                      % (categ, name))
+            resolved[(known[categ], name)] = desc
+        _upsertItems(connection, resolved, user_id)
+        refreshItemCounts(connection,
+                          set(categ_id for categ_id, name in resolved))
+        _logItemChanges(connection, resolved, user_id)
+        stats['items'] += len(resolved)
+
+    return stats
+
+
+"""
+Export
+"""
+
+
+def exportRecords(session, batch_size=BATCH_SIZE):
+    """
+    Yields every category, then every item, as import records. Reads with
+    a server-side cursor, so memory stays flat for any catalog size.
+    """
+    def stream(statement):
+        result = session.execute(
+                    statement.execution_options(stream_results=True))
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
+
+    for name, desc in stream(select([category_table.c.name,
+                                     category_table.c.description]).
+                             order_by(category_table.c.id)):
+        yield {'type': 'category', 'name': name, 'description': desc}
+
+    for categ, name, desc in stream(
+            select([category_table.c.name, item_table.c.name,
+                    item_table.c.description]).select_from(
+                item_table.join(category_table)).order_by(item_table.c.id)):
+        yield {'type': 'item', 'category': categ, 'name': name,
+               'description': desc}
+
+
+"""
+CLI
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                    description="Bulk import/export catalog data")
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', nargs='?', default='-',
+                        help="file to import ('-' for stdin)")
+    parser.add_argument('--format', choices=sorted(PARSERS),
+                        default='ndjson')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    engine = getEngine()
+    session = sessionmaker(bind=engine)()
+
+    if args.command == 'export':
+        for chunk in FORMATTERS[args.format](
+                exportRecords(session, args.batch_size)):
+            sys.stdout.write(chunk)
+        return 0
+
+    source = sys.stdin if args.path == '-' else open(args.path, 'rb')
+    try:
+        stats = importRecords(session, PARSERS[args.format](source),
+                              batch_size=args.batch_size)
+        session.commit()
+    except BulkImportError as e:
+        session.rollback()
+        sys.stderr.write("Import failed: %s\n" % e)
+        return 1
+    finally:
+        source.close()
+
+    print "Imported %(categories)d categories and %(items)d items" % stats
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Catalog data cache:
+    - CacheBackend, the interface a shared store (e.g. Redis) implements
+    - LRUCache, the default in-process backend (LRU with TTL)
+    - VersionedCache, caches values under the current catalog data
+      version, bumped on every committed write, with hit/miss counters
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class CacheBackend(object):
+    """
+    Minimal key/value store interface. Counters (incr/counter) are kept
+    apart from cached values, they must never be evicted or expire.
+    """
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def incr(self, key):
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    # Thread safe, process-local, least recently used entries are evicted
+    # beyond maxsize, entries expire after ttl seconds (None: never)
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.counters = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                return None
+            # Re-insert as most recently used
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def purge(self):
+        # Drops expired entries now instead of on their next get(), returns
+        # how many were dropped
+        now = time.time()
+        with self.lock:
+            expired = [key for key, (expires, value)
+                       in self.entries.items()
+                       if expires is not None and expires < now]
+            for key in expired:
+                del self.entries[key]
+        return len(expired)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def counter(self, key):
+        with self.lock:
+            return self.counters.get(key, 0)
+
+
+class VersionedCache(object):
+    """
+    Values are stored under "<name>:<version>", so bump() invalidates
+    everything cached for older data at once, in every process sharing
+    the backend. Old entries simply age out.
+    """
+    VERSION_KEY = 'catalog:version'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        return self.backend.counter(self.VERSION_KEY)
+
+    def bump(self):
+        return self.backend.incr(self.VERSION_KEY)
+
+    def get_or_create(self, name, creator, ttl=None):
+        key = '%s:%d' % (name, self.version())
+        value = self.backend.get(key)
+        if value is not None:
+            with self.lock:
+                self.hits += 1
+            return value
+
+        with self.lock:
+            self.misses += 1
+        value = creator()
+        self.backend.set(key, value, ttl)
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {'version': self.version(), 'hits': self.hits,
+                    'misses': self.misses}
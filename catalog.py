@@ -8,34 +8,357 @@ Item Catalog Application:
 """
 
 import os
+import time
+import functools
+import datetime
 import hashlib
-import httplib2
-import requests
+import threading
+import re
 import json
+import logging
 
-from flask import (Flask, render_template, request, redirect,
-                   flash, url_for, make_response, jsonify,
+from flask import (Flask, Response, render_template, request, redirect,
+                   flash, url_for, make_response, jsonify, g, abort,
+                   stream_with_context, has_request_context,
+                   json as flask_json,
                    session as login_session)
+from flask.json import JSONEncoder
 
-from sqlalchemy import create_engine, desc, exc
-from sqlalchemy.engine.url import URL
-from sqlalchemy.orm import sessionmaker, exc as orm_exc
+from sqlalchemy import (desc, exc, event, select, tuple_, literal, func,
+                        cast, or_, and_, REAL)
+from sqlalchemy.orm import (sessionmaker, scoped_session, contains_eager,
+                            joinedload, lazyload, selectinload,
+                            exc as orm_exc)
 from database_setup import (Base, Category, Item, LoginType, User, Role,
-                            DATABASE)
+                            SerializableOrdered, SEARCH_CONFIG, session_table,
+                            getEngine, getReplicaEngines, recordBulkActivity,
+                            logBulkChanges, change_table, CHANGE_ENTITIES,
+                            ACTIVITY_SIZE)
+import activity
+import bulk
+import config
+import fragments
+import googleauth
+import instrumentation
+import logconfig
+import routing
+import sessions
+from cache import LRUCache, VersionedCache
 
 # OAuth2 related imports
-from oauth2client.client import flow_from_clientsecrets, FlowExchangeError
+from oauth2client.client import FlowExchangeError
 
-CLIENT_ID = json.loads(
-                   open('client_secrets.json', 'r').read())['web']['client_id']
 
-app = Flask(__name__)
+class CatalogJSONEncoder(JSONEncoder):
+    # Serializes our models for jsonify() via their cached column accessors,
+    # each object encodes exactly as simplejson's _asdict() handling did
+    def default(self, o):
+        if isinstance(o, SerializableOrdered):
+            return o._asdict()
+        return JSONEncoder.default(self, o)
+
 
-engine = create_engine(URL(**DATABASE))
+app = Flask(__name__)
+app.json_encoder = CatalogJSONEncoder
+# Deployment settings (a Python config file), read before any default
+# below is applied
+app.config.from_envvar('CATALOG_SETTINGS', silent=True)
+
+# Route tracing is logged at DEBUG, off unless enabled (see logconfig.py)
+log = logging.getLogger('catalog')
+api_log = logging.getLogger('catalog.api')
+logconfig.init_app(app)
+# OAuth client, secret key and database settings, loaded and validated
+# once, reloaded on SIGHUP (see config.py)
+catalog_config = config.init_app(app)
+# Seconds a resolved (login_type, email) -> roles lookup is reused across
+# requests by this process, 0 disables the cache. Commits only clear the
+# cache of the process that made them, so with several workers a role
+# change (e.g. a revoked admin) can take up to this long to apply.
+app.config.setdefault('AUTH_CACHE_TTL', 60)
+# Rows fetched per round trip (server-side cursor) by streamed JSON exports
+app.config.setdefault('JSON_STREAM_BATCH', 500)
+# Default/maximum rows per page for keyset (?limit=&after=) pagination
+app.config.setdefault('PAGE_SIZE', 50)
+app.config.setdefault('MAX_PAGE_SIZE', 500)
+# Enforce QUERY_BUDGETS on every request (always on when app.testing)
+app.config.setdefault('QUERY_BUDGET_CHECK', False)
+# Default in-process backend for the catalog data cache (see cache.py)
+app.config.setdefault('CACHE_MAXSIZE', 256)
+app.config.setdefault('CACHE_TTL', 300)
+# Cache-Control sent with conditional (ETag/Last-Modified) responses, pages
+# vary by login so they may only be kept by the browser
+app.config.setdefault('JSON_CACHE_CONTROL', 'public, max-age=0, '
+                                            'must-revalidate')
+app.config.setdefault('PAGE_CACHE_CONTROL', 'private, max-age=0, '
+                                            'must-revalidate')
+# Seconds between reads of other processes' item activity, default/maximum
+# entries per feed response
+app.config.setdefault('FEED_REFRESH_INTERVAL', 2)
+app.config.setdefault('FEED_PAGE_SIZE', 50)
+app.config.setdefault('MAX_FEED_PAGE_SIZE', ACTIVITY_SIZE)
+# Seconds a user's reads stay on the primary after they commit a write, at
+# least the replicas' replication lag (CATALOG_REPLICA_URLS)
+app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+
+# Connects lazily, workers start even while the database is unreachable
+engine = getEngine()
 Base.metadata.bind = engine
+# Read replicas, [] unless CATALOG_REPLICA_URLS is set
+replicas = getReplicaEngines()
+
+
+def readsFromPrimary():
+    # Writing requests, and users until REPLICA_STICKY_SECONDS after their
+    # last commit, so they read their own writes
+    if not has_request_context():
+        return False
+    return request.method not in ('GET', 'HEAD', 'OPTIONS') or \
+        login_session.get('primary_until', 0) > time.time()
+
+
+# Reads go to a replica, writes to the primary engine (see routing.py)
+DBSession = sessionmaker(class_=routing.RoutingSession, bind=engine,
+                         replicas=replicas, use_primary=readsFromPrimary)
+# Thread/request scoped session, each worker thread gets its own Session
+# (and pooled connection), removed again in shutdownSession() below
+session = scoped_session(DBSession)
+
+# Pooled, keep-alive HTTP client for the Google OAuth calls (GOOGLE_*
+# config, see googleauth.py)
+google_auth = googleauth.init_app(app, catalog_config.settings.client_id)
+
+
+@catalog_config.on_reload
+def applyClientId(settings):
+    google_auth.client_id = settings.client_id
+
+
+# Server-side login sessions, the cookie only holds an opaque session id
+# (SESSION_BACKEND config, see sessions.py)
+sessions.init_app(app, engine, session_table)
+
+# Opt-in Server-Timing headers and /debug/metrics (INSTRUMENTATION config)
+instrumentation.init_app(app, engine, replicas)
+
+
+@app.teardown_appcontext
+def shutdownSession(exception=None):
+    # Rollback anything left uncommitted, close the Session and return its
+    # connection to the pool at the end of every request
+    session.remove()
+
+
+# Most SQL statements each endpoint may issue per request (including the
+# one auth lookup for a logged in user and conditional()'s validator).
+# Checked by checkQueryBudget() when testing, so an N+1 lazy load
+# regression fails instead of slowly degrading every page.
+QUERY_BUDGETS = {
+    'catalogHome': 3,
+    'catalogHomeFull': 3,
+    'categoryInfo': 3,
+    'categItems': 5,
+    'itemInfo': 4,
+    'getUsers': 2,
+    'searchCatalog': 4,
+    'categoriesJSON': 2,
+    'singleCategJSON': 2,
+    'singleCategItemsJSON': 2,
+    'singleItemJSON': 3,
+    'loginTypesJSON': 1,
+    'rolesJSON': 1,
+    'usersJSON': 1,
+    'searchJSON': 2,
+    'activityJSON': 1,
+    'activityAtom': 1,
+    'catalogChanges': 3,
+    'healthLive': 0,
+    'healthReady': 1 + len(replicas)
+}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def countStatement(conn, cursor, statement, parameters, context,
+                   executemany):
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+
+
+for counted in [engine] + replicas:
+    event.listen(counted, 'before_cursor_execute', countStatement)
+
+
+@app.before_request
+def resetStatementCount():
+    g.sql_statements = 0
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+
+@app.after_request
+def checkQueryBudget(response):
+    if app.testing or app.config['QUERY_BUDGET_CHECK']:
+        budget = QUERY_BUDGETS.get(request.endpoint)
+        count = g.get('sql_statements', 0)
+        if budget is not None and count > budget:
+            raise QueryBudgetExceeded("%s issued %d SQL statements, budget "
+                                      "is %d" % (request.endpoint, count,
+                                                 budget))
+    return response
+
+
+# Process-local TTL cache for resolved user roles, keyed on
+# (login_type, email) -> (expires, roles)
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+
+def getCachedRoles(source, user_email):
+    ttl = app.config['AUTH_CACHE_TTL']
+    if not ttl:
+        return None
+
+    # Roles kept in the user's session record, then the process cache
+    cached = login_session.get('roles')
+    if cached is not None and cached['expires'] >= time.time() and \
+            cached['user'] == [source, user_email]:
+        return dict(cached['roles'])
+
+    with _auth_cache_lock:
+        entry = _auth_cache.get((source, user_email))
+    if entry is None or entry[0] < time.time():
+        return None
+    return dict(entry[1])
+
+
+def setCachedRoles(source, user_email, roles):
+    ttl = app.config['AUTH_CACHE_TTL']
+    if not ttl:
+        return
+
+    with _auth_cache_lock:
+        _auth_cache[(source, user_email)] = (time.time() + ttl, dict(roles))
+    login_session['roles'] = {'user': [source, user_email],
+                              'roles': dict(roles),
+                              'expires': time.time() + ttl}
+
+
+def invalidateAuthCache():
+    with _auth_cache_lock:
+        _auth_cache.clear()
+    # Other users' sessions keep their roles until AUTH_CACHE_TTL runs out
+    if has_request_context():
+        login_session.pop('roles', None)
+
+
+@event.listens_for(DBSession, 'after_flush')
+def flagAuthChanges(db_session, flush_context):
+    # New/changed/deleted Users (incl. their roles) or Roles make cached
+    # role lookups stale once this transaction commits
+    for obj in list(db_session.new) + list(db_session.dirty) + \
+            list(db_session.deleted):
+        if isinstance(obj, (User, Role)):
+            db_session.info['auth_changed'] = True
+            break
+
+
+@event.listens_for(DBSession, 'after_commit')
+def expireAuthCache(db_session):
+    if db_session.info.pop('auth_changed', False):
+        invalidateAuthCache()
+
+
+@event.listens_for(DBSession, 'after_soft_rollback')
+def discardAuthChanges(db_session, previous_transaction):
+    db_session.info.pop('auth_changed', None)
+
+
+# Catalog data (category list, latest items) cached under a version that
+# every committed Category/Item write bumps. Swap data_cache.backend for a
+# shared CacheBackend to share entries and the version across processes.
+data_cache = VersionedCache(LRUCache(app.config['CACHE_MAXSIZE'],
+                                     app.config['CACHE_TTL']))
+# Template bytecode cache (TEMPLATE_CACHE_DIR) and {% cache %} fragments,
+# stored in data_cache
+fragments.init_app(app, data_cache)
+# Newest item activity held in memory, for the home page and feeds
+activity_feed = activity.ActivityFeed(
+                    interval=app.config['FEED_REFRESH_INTERVAL'])
+
+
+@event.listens_for(DBSession, 'after_flush')
+def flagCatalogChanges(db_session, flush_context):
+    for obj in list(db_session.new) + list(db_session.dirty) + \
+            list(db_session.deleted):
+        if isinstance(obj, (Category, Item)):
+            db_session.info['catalog_changed'] = True
+            break
+
+
+@event.listens_for(DBSession, 'after_bulk_delete')
+@event.listens_for(DBSession, 'after_bulk_update')
+def flagCatalogBulkChanges(bulk_context):
+    if bulk_context.mapper.class_ in (Category, Item):
+        bulk_context.session.info['catalog_changed'] = True
+
+
+@event.listens_for(DBSession, 'after_commit')
+def bumpCatalogVersion(db_session):
+    if db_session.info.pop('catalog_changed', False):
+        data_cache.bump()
+        activity_feed.expire()
+
+
+@event.listens_for(DBSession, 'after_soft_rollback')
+def discardCatalogChanges(db_session, previous_transaction):
+    db_session.info.pop('catalog_changed', None)
+
+
+@event.listens_for(DBSession, 'after_commit')
+def stickToPrimary(db_session):
+    # The writer's next requests read from the primary until the replicas
+    # have caught up with this commit
+    if replicas and db_session.info.get('wrote') and has_request_context():
+        login_session['primary_until'] = \
+            time.time() + app.config['REPLICA_STICKY_SECONDS']
+
+
+def cachedCategories():
+    # Sidebar categories, plain dicts so they outlive the request Session
+    # Loaded from the primary, a lagging replica would keep stale entries
+    # under the new data version
+    def load():
+        with session().primary():
+            return [{'id': categ.id, 'name': categ.name,
+                     'item_count': categ.item_count}
+                    for categ in session.query(Category.id, Category.name,
+                                               Category.item_count).
+                    order_by(Category.id)]
+    return data_cache.get_or_create('categories', load)
+
+
+def cachedLatestItems():
+    # Latest 10 items with their category name (as item.category.name),
+    # picked from the activity feed and looked up by id. Falls back to the
+    # created index when the feed holds too few creates (e.g. after many
+    # edits).
+    def load():
+        total = sum(categ['item_count'] for categ in cachedCategories())
+        with session().primary():
+            activity_feed.refresh(session)
+            ids = activity_feed.createdItemIds(10)
+            query = session.query(Item.id, Item.name, Category.name).join(
+                                   Item.category)
+            rows = query.filter(Item.id.in_(ids)).all() if ids else []
+            if len(rows) < min(10, total):
+                rows = query.order_by(desc(Item.created)).limit(10).all()
+            else:
+                rows.sort(key=lambda row: ids.index(row[0]))
+            return [{'id': item_id, 'name': name,
+                     'category': {'name': categ}}
+                    for item_id, name, categ in rows]
+    return data_cache.get_or_create('latest_items', load)
 
 
 # Helper functions
@@ -61,24 +384,35 @@ def createUser(login_session):
                     logintype_id=logintype.id)
 
     session.add(new_user)
+    # Commit also invalidates the role cache (see expireAuthCache)
     session.commit()
+    # Forget any "no such user" lookup memoized for this request
+    g.pop('users', None)
+    g.pop('auth', None)
     return new_user.id
 
 
 def getUser(source, user_email):
-    # Grab login type
-    logintype = session.query(LoginType).filter_by(source=source).one()
+    # Looked up once per request, then reused from flask.g
+    users = g.setdefault('users', {})
+    if (source, user_email) in users:
+        return users[(source, user_email)]
 
-    # Grab the User object
+    # Grab the User object, with its login type and roles, in one query
     try:
-        print "Source is %s and Email is %s" % (source, user_email)
-        email = user_email
-        user = session.query(User).filter_by(logintype_id=logintype.id,
-                                             email=email).one()
-        return user
+        log.debug("Looking up %s user", source)
+        user = session.query(User).join(User.logintype).options(
+                                contains_eager(User.logintype),
+                                joinedload(User.roles)).filter(
+                                LoginType.source == source,
+                                User.email == user_email).one()
     except orm_exc.NoResultFound:
-        print "User doesn't exist, or error retrieving, from our database."
-        return None
+        log.debug("User doesn't exist, or error retrieving, from our "
+                  "database.")
+        user = None
+
+    users[(source, user_email)] = user
+    return user
 
 
 def getUserRoles(user):
@@ -95,6 +429,10 @@ def getUserRoles(user):
 
 
 def getAppAuth():
+    # Resolved once per request
+    if 'auth' in g:
+        return g.auth
+
     # Dictionary for return values
     auth = dict()
     user = None
@@ -103,16 +441,308 @@ def getAppAuth():
 
     # Check if we have a user logged on in our login_session
     if 'email' in login_session:
-        user = getUser(login_session['login_type'], login_session['email'])
-
-    user_roles = getUserRoles(user)
+        source = login_session['login_type']
+        email = login_session['email']
+
+        user_roles = getCachedRoles(source, email)
+        if user_roles is None:
+            user = getUser(source, email)
+            user_roles = getUserRoles(user)
+            if user is not None:
+                setCachedRoles(source, email, user_roles)
+    else:
+        user_roles = getUserRoles(user)
 
     # Build our response
     auth['roles'] = user_roles
 
+    g.auth = auth
     return auth
 
 
+def parseArg(name, parse, default=None):
+    # Query string argument converted by parse(), 400 if it can't be
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return parse(value)
+    except ValueError:
+        abort(400)
+
+
+def pageArgs(parse_after=int):
+    """
+    Returns (limit, after) from the ?limit=&after= query args. The 'after'
+    cursor holds the keyset values of the last row of the previous page,
+    by default just its id.
+    """
+    limit = parseArg('limit', int, app.config['PAGE_SIZE'])
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    after = parseArg('after', parse_after)
+    return limit, after
+
+
+def isPaged():
+    """True if the request asked for a page (?limit= and/or ?after=)."""
+    return 'limit' in request.args or 'after' in request.args
+
+
+def nextPage(rows, limit, cursor):
+    """
+    Pages are fetched with limit + 1 rows, the extra row tells us there is
+    a next page. Returns (page rows, next page url or None).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    args = request.args.to_dict()
+    args.update(request.view_args or {})
+    args.update(limit=limit, after=cursor(rows[-1]))
+    return rows, url_for(request.endpoint, **args)
+
+
+class UTC(datetime.tzinfo):
+    # Fixed UTC tzinfo for item cursors (Python 2 has no timezone.utc)
+    def utcoffset(self, dt):
+        return datetime.timedelta(0)
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def itemCursor(item):
+    """
+    Newest-first item cursor "<created>,<id>". Timezone aware timestamps
+    are written in UTC with a 'Z' suffix.
+    """
+    created = item.created
+    suffix = ''
+    if created.tzinfo is not None:
+        created = created.astimezone(UTC()).replace(tzinfo=None)
+        suffix = 'Z'
+    return '%s%s,%d' % (created.strftime(CURSOR_TIME_FORMAT), suffix,
+                        item.id)
+
+
+def parseItemCursor(value):
+    # Inverse of itemCursor(), raises ValueError on a malformed cursor
+    created, item_id = value.rsplit(',', 1)
+    tzinfo = None
+    if created.endswith('Z'):
+        created = created[:-1]
+        tzinfo = UTC()
+    created = datetime.datetime.strptime(created, CURSOR_TIME_FORMAT)
+    return created.replace(tzinfo=tzinfo), int(item_id)
+
+
+def itemsNewestAfter(after):
+    # Keyset criterion continuing newest-first (created, id) ordering
+    # below the (created, id) cursor, independent of whether that item
+    # still exists
+    created, item_id = after
+    return tuple_(Item.created, Item.id) < tuple_(
+                                literal(created, Item.created.type),
+                                literal(item_id, Item.id.type))
+
+
+def pagedRowDicts(model, statement):
+    # Keyset paging on the model's id for the list JSON endpoints,
+    # returns (rows, next page url or None)
+    limit, after = pageArgs()
+    if after is not None:
+        statement = statement.where(model.id > after)
+    rows = rowDicts(model, statement.order_by(model.id).limit(limit + 1))
+    return nextPage(rows, limit, lambda row: row['id'])
+
+
+# Search terms are runs of letters/digits, so they can't carry tsquery
+# or LIKE syntax
+SEARCH_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+SEARCH_MAX_WORDS = 16
+SEARCH_CATEGORIES = 10
+
+
+def searchWords(text):
+    return [word.lower() for word
+            in SEARCH_WORD.findall(text or u'')][:SEARCH_MAX_WORDS]
+
+
+def searchMatch(model, words):
+    """
+    Returns (criterion, rank) matching model rows containing every word.
+    On PostgreSQL a full text match on the GIN indexed search_vector, each
+    word a prefix ('foo:* & ba:*'), ranked by ts_rank. Elsewhere (SQLite)
+    a case insensitive substring scan of name and description, rank 0.
+    """
+    if engine.dialect.name == 'postgresql':
+        query = func.to_tsquery(SEARCH_CONFIG,
+                                ' & '.join('%s:*' % word for word in words))
+        return (model.search_vector.op('@@')(query),
+                func.ts_rank(model.search_vector, query))
+
+    criteria = [or_(func.lower(model.name).contains(word, autoescape=True),
+                    func.lower(model.description).contains(
+                                                  word, autoescape=True))
+                for word in words]
+    return and_(*criteria), cast(literal(0), REAL)
+
+
+def searchCursor(row):
+    # "<rank>,<id>" of a (model instance, rank) search result row
+    return '%r,%d' % (row.rank, row[0].id)
+
+
+def parseSearchCursor(value):
+    rank, row_id = value.rsplit(',', 1)
+    return float(rank), int(row_id)
+
+
+def searchPage(query, model, words):
+    """
+    Page of (model instance, rank) rows of query matching words, best
+    first then by id, keyset paged on (rank, id). Returns (rows, next page
+    url or None).
+    """
+    limit, after = pageArgs(parseSearchCursor)
+    match, rank = searchMatch(model, words)
+    query = query.add_columns(rank.label('rank')).filter(match)
+    if after is not None:
+        # Compared as REAL, the type ts_rank returns, so the cursor's rank
+        # equals that of the row it came from
+        last_rank = cast(literal(after[0]), REAL)
+        query = query.filter(or_(rank < last_rank,
+                                 and_(rank == last_rank,
+                                      model.id > after[1])))
+    rows = query.order_by(rank.desc(), model.id).limit(limit + 1).all()
+    return nextPage(rows, limit, searchCursor)
+
+
+def searchCategories(words):
+    # Best matching categories, shown above the first page of item results
+    if 'after' in request.args:
+        return []
+    match, rank = searchMatch(Category, words)
+    return session.query(Category).filter(match).order_by(
+                         rank.desc(), Category.id).limit(
+                         SEARCH_CATEGORIES).all()
+
+
+def freshness(model, *criteria):
+    """
+    Scalar subqueries for the row count and latest created/updated time of
+    the model rows matching criteria. Any insert, update or delete changes
+    one of the two.
+    """
+    stamp = func.coalesce(model.updated, model.created)
+    count = select([func.count(model.id)])
+    latest = select([func.max(stamp)])
+    for criterion in criteria:
+        count = count.where(criterion)
+        latest = latest.where(criterion)
+    return [count.as_scalar(), latest.as_scalar()]
+
+
+def categoryId(name):
+    return select([Category.id]).where(Category.name == name).as_scalar()
+
+
+def catalogFreshness():
+    return freshness(Category) + freshness(Item)
+
+
+def exportFreshness(fmt):
+    return catalogFreshness()
+
+
+def categoriesFreshness():
+    return freshness(Category)
+
+
+def itemsFreshness():
+    return freshness(Item)
+
+
+def categoryFreshness(category):
+    return freshness(Category, Category.name == category)
+
+
+def categoryItemsFreshness(category):
+    return freshness(Category, Category.name == category) + \
+        freshness(Item, Item.category_id == categoryId(category))
+
+
+def itemFreshness(category, item):
+    return freshness(Category, Category.name == category) + \
+        freshness(Item, Item.category_id == categoryId(category),
+                  Item.name == item)
+
+
+def toUTC(stamp):
+    # Naive UTC datetime, as used by werkzeug for HTTP dates
+    if stamp is not None and stamp.tzinfo is not None:
+        stamp = stamp.astimezone(UTC()).replace(tzinfo=None)
+    return stamp
+
+
+def conditional(validator, page=False):
+    """
+    Decorator for GET views: one aggregate query (validator(**view_args))
+    gives the ETag and Last-Modified of the response. A request whose
+    If-None-Match / If-Modified-Since still match gets a 304 without the
+    view running. Pages (page=True) also vary by login and are never
+    answered with a 304 while flash messages are pending.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if page and '_flashes' in login_session:
+                return view(*args, **kwargs)
+
+            values = list(session.execute(
+                                 select(validator(*args, **kwargs))).first())
+            stamps = [toUTC(value) for value in values
+                      if isinstance(value, datetime.datetime)]
+            last_modified = max(stamps) if stamps else None
+
+            parts = [request.full_path] + [str(value) for value in values]
+            if page:
+                parts.append(login_session.get('email', ''))
+                parts.append(str(sorted(getAppAuth()['roles'].items())))
+            etag = hashlib.md5('|'.join(parts)).hexdigest()
+            cache_control = app.config['PAGE_CACHE_CONTROL' if page
+                                       else 'JSON_CACHE_CONTROL']
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and
+                                request.if_modified_since is not None and
+                                last_modified.replace(microsecond=0) <=
+                                request.if_modified_since.replace(
+                                                           tzinfo=None))
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if last_modified is not None:
+                    response.last_modified = last_modified
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            if page:
+                response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
 """
 Route Specific
 """
@@ -121,14 +751,14 @@ Route Specific
 @app.route('/')
 @app.route('/catalog/')
 def catalogHome():
-    print "In catalogHome()"
+    log.debug("In catalogHome()")
     # Grab app authorizations, if any
     auth = getAppAuth()
     is_admin = auth['roles']['admin']
     is_contrib = auth['roles']['contrib']
-    categories = session.query(Category).all()
-    latest_items = session.query(Item).order_by(
-                                            desc(Item.created)).limit(10).all()
+    # Both served from data_cache until the next catalog write
+    categories = cachedCategories()
+    latest_items = cachedLatestItems()
 
     return render_template("catalog.html", is_admin=is_admin,
                            is_contrib=is_contrib, categories=categories,
@@ -141,17 +771,24 @@ def catalogHomeFull():
     Endpoint to view ALL items, as only 10 are displayed in LatestItems
     on page load by default.
     """
-    print "In catalogHomeFull()"
+    log.debug("In catalogHomeFull()")
     auth = getAppAuth()
     is_admin = auth['roles']['admin']
     is_contrib = auth['roles']['contrib']
-    categories = session.query(Category).all()
-    all_items = session.query(Item).order_by(
-                                         desc(Item.created)).all()
+    categories = cachedCategories()
+
+    # Paged newest first, keyset on (created, id)
+    limit, after = pageArgs(parseItemCursor)
+    query = session.query(Item).options(joinedload(Item.category))
+    if after is not None:
+        query = query.filter(itemsNewestAfter(after))
+    all_items = query.order_by(desc(Item.created),
+                               desc(Item.id)).limit(limit + 1).all()
+    all_items, next_url = nextPage(all_items, limit, itemCursor)
 
     return render_template("catalog.html", is_admin=is_admin,
                            is_contrib=is_contrib, categories=categories,
-                           all_items=all_items)
+                           all_items=all_items, next_url=next_url)
 
 
 """
@@ -160,8 +797,9 @@ Category Specific
 
 
 @app.route('/catalog/<category>/')
+@conditional(categoryFreshness, page=True)
 def categoryInfo(category):
-    print "In categoryInfo(category) for %s" % category
+    log.debug("In categoryInfo(category) for %s", category)
     # Grab app authorizations, if any
     auth = getAppAuth()
     is_admin = auth['roles']['admin']
@@ -175,7 +813,7 @@ def categoryInfo(category):
 
 @app.route('/catalog/category/new/', methods=['GET', 'POST'])
 def newCategory():
-    print "In newCategory()"
+    log.debug("In newCategory()")
     # Login redirect if User Not Logged IN for CREATE
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -191,7 +829,7 @@ def newCategory():
 
     # Otherwise proceed with our requests
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our user
         user = getUser(login_session['login_type'], login_session['email'])
@@ -219,13 +857,13 @@ def newCategory():
             finally:
                 return redirect(url_for('catalogHome'))
     else:
-        print "Get called"
+        log.debug("Get called")
         return render_template("new-category.html")
 
 
 @app.route('/catalog/<category>/edit/', methods=['GET', 'POST'])
 def editCategory(category):
-    print "In editCategory()"
+    log.debug("In editCategory()")
     # Login redirect if User Not Logged IN for CREATE
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -244,7 +882,7 @@ def editCategory(category):
                         Category).filter(Category.name == str(category)).one()
 
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our values
         name = request.form['name']
@@ -272,13 +910,13 @@ def editCategory(category):
             finally:
                 return redirect(url_for('catalogHome'))
     else:
-        print "Get request called"
+        log.debug("Get request called")
         return render_template("edit-category.html", category=curr_categ)
 
 
 @app.route('/catalog/<category>/delete/', methods=['GET', 'POST'])
 def deleteCategory(category):
-    print "In deleteCategory()"
+    log.debug("In deleteCategory()")
     # Login redirect if User Not Logged IN for CREATE
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -297,25 +935,33 @@ def deleteCategory(category):
                         Category).filter(Category.name == str(category)).one()
 
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our hidden form values
         frm_name = request.form['name']
 
         if (curr_categ.name == frm_name):
 
-            # We should be good to DELETE our category
-            for item in curr_categ.items:
-                session.delete(item)
-
+            # We should be good to DELETE our category, its items go in a
+            # single set based DELETE (nothing loaded into the Session), all
+            # in one transaction. The items' activity and tombstones are
+            # recorded first, the bulk delete skips the ORM events.
+            recordBulkActivity(session.connection(), 'delete',
+                               Item.category_id == curr_categ.id, user.id)
+            logBulkChanges(session.connection(), 'item', 'delete',
+                           Item.category_id == curr_categ.id)
+            removed = session.query(Item).filter(
+                            Item.category_id == curr_categ.id).delete(
+                            synchronize_session=False)
             session.delete(curr_categ)
             session.commit()
 
-            msg = "Deleted %s successfully!" % curr_categ.name
+            msg = "Deleted %s (and %d items) successfully!" % (
+                                                       frm_name, removed)
             flash(msg)
             return redirect(url_for('catalogHome'))
     else:
-        print "Get request called"
+        log.debug("Get request called")
         return render_template("delete-category.html", category=curr_categ)
 
 
@@ -325,17 +971,21 @@ Item Specific
 
 
 @app.route('/catalog/<category>/items/')
+@conditional(categoryItemsFreshness, page=True)
 def categItems(category):
-    print "In categItems(category) for %s" % category
+    log.debug("In categItems(category) for %s", category)
     # Grab app authorizations, if any
     auth = getAppAuth()
     is_contrib = auth['roles']['contrib']
 
-    categories = session.query(Category).all()
+    categories = cachedCategories()
     curr_categ = session.query(Category).filter(
                                           Category.name == str(category)).one()
 
-    categ_items = session.query(Item).filter(
+    # Every item's category is curr_categ, already in the identity map, so
+    # a lazy many-to-one load resolves it without SQL (no extra join)
+    categ_items = session.query(Item).options(
+                         lazyload(Item.category)).filter(
                          Item.category == curr_categ).order_by(Item.name).all()
 
     return render_template("categ-items.html", is_contrib=is_contrib,
@@ -344,8 +994,9 @@ def categItems(category):
 
 
 @app.route('/catalog/<category>/<item>/')
+@conditional(itemFreshness, page=True)
 def itemInfo(category, item):
-    print "In itemInfo(category, item) for %s | %s" % (category, item)
+    log.debug("In itemInfo(category, item) for %s | %s", category, item)
     # Grab app authorizations, if any
     auth = getAppAuth()
     is_contrib = auth['roles']['contrib']
@@ -362,7 +1013,7 @@ def itemInfo(category, item):
 
 @app.route('/catalog/item/new/', methods=['GET', 'POST'])
 def newCatalogItem():
-    print "In newCatalogItem()"
+    log.debug("In newCatalogItem()")
     # Login redirect if User Not Logged IN for EDIT
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -380,7 +1031,7 @@ def newCatalogItem():
     categories = session.query(Category).order_by(Category.name).all()
 
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our values
         name = request.form['name']
@@ -408,13 +1059,13 @@ def newCatalogItem():
             finally:
                 return redirect(url_for('catalogHome'))
     else:
-        print "Get called"
+        log.debug("Get called")
         return render_template("new-item.html", categories=categories)
 
 
 @app.route('/catalog/<category>/<item>/edit/', methods=['GET', 'POST'])
 def editCatalogItem(category, item):
-    print "In editCatalogItem()"
+    log.debug("In editCatalogItem()")
     # Login redirect if User Not Logged IN for EDIT
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -436,7 +1087,7 @@ def editCatalogItem(category, item):
     categories = session.query(Category).order_by(Category.name).all()
 
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our values
         name = request.form['name']
@@ -466,14 +1117,14 @@ def editCatalogItem(category, item):
             finally:
                 return redirect(url_for('catalogHome'))
     else:
-        print "Get request called"
+        log.debug("Get request called")
         return render_template("edit-item.html", item=curr_item,
                                categories=categories)
 
 
 @app.route('/catalog/<category>/<item>/delete/', methods=['GET', 'POST'])
 def deleteCatalogItem(category, item):
-    print "In deleteCatalogItem()"
+    log.debug("In deleteCatalogItem()")
     # Login redirect if User Not Logged IN for DELETE
     if 'email' not in login_session:
         return redirect(url_for('showLogin'))
@@ -494,7 +1145,7 @@ def deleteCatalogItem(category, item):
                                               category=curr_categ).one()
 
     if request.method == 'POST':
-        print "In Post"
+        log.debug("In Post")
 
         # Grab our hidden
         frm_name = request.form['name']
@@ -502,7 +1153,9 @@ def deleteCatalogItem(category, item):
 
         if (curr_item.name == frm_name and curr_categ.name == frm_categ):
 
-            # We should be good to DELETE our item
+            # We should be good to DELETE our item, recorded as deleted by
+            # this user in the item activity
+            curr_item.last_update_by = user.id
             session.delete(curr_item)
             session.commit()
 
@@ -510,18 +1163,47 @@ def deleteCatalogItem(category, item):
             flash(msg)
             return redirect(url_for('catalogHome'))
     else:
-        print "Get request called"
+        log.debug("Get request called")
         return render_template("delete-item.html", item=curr_item)
 
 
 @app.route('/users/')
 def getUsers():
-    print "In getUsers()"
-    users = session.query(User).all()
+    log.debug("In getUsers()")
+    # Roles of every listed user in one extra query
+    users = session.query(User).options(selectinload(User.roles)).all()
 
     return render_template("users.html", users=users)
 
 
+"""
+Search Specific
+"""
+
+
+@app.route('/catalog/search/')
+def searchCatalog():
+    log.debug("In searchCatalog()")
+    auth = getAppAuth()
+    is_contrib = auth['roles']['contrib']
+    categories = cachedCategories()
+
+    q = request.args.get('q', '')
+    words = searchWords(q)
+    found_categories, found_items, next_url = [], [], None
+    if words:
+        found_categories = searchCategories(words)
+        found_items, next_url = searchPage(
+                        session.query(Item).options(
+                            joinedload(Item.category)), Item, words)
+
+    return render_template("search.html", is_contrib=is_contrib,
+                           categories=categories, q=q,
+                           found_categories=found_categories,
+                           found_items=[item for item, rank in found_items],
+                           next_url=next_url)
+
+
 """
 Login Specific
 """
@@ -538,31 +1220,41 @@ def showLogin():
 @app.route('/gconnect', methods=['POST'])
 def gconnect():
     if request.args.get('state') != login_session['state']:
-        print "request args: %s" % request.args.get('state')
-        print "login_session: %s" % login_session['state']
+        log.warning("Invalid state parameter in gconnect")
         response = make_response(json.dumps('Invalid state parameter'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
     else:
         code = request.data
         try:
-            # Upgrade auth code into credentials object
-            oauth_flow = flow_from_clientsecrets('client_secrets.json',
-                                                 scope='')
-            oauth_flow.redirect_uri = 'postmessage'
-            credentials = oauth_flow.step2_exchange(code)
+            # Upgrade auth code into credentials object, the flow is built
+            # from the settings loaded at startup
+            oauth_flow = catalog_config.settings.flow()
+            credentials = google_auth.exchange(oauth_flow, code)
         except FlowExchangeError:
             response = make_response(json.dumps("""Failed to upgrade the
                                      authorization code."""), 401)
             response.headers['Content-Type'] = 'application/json'
             return response
+        except googleauth.GoogleAuthError as e:
+            log.warning("Google code exchange failed: %s", e)
+            response = make_response(json.dumps("Google is unreachable."),
+                                     503)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
-        # Check that access token is valid
-        access_token = credentials.access_token
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-               % access_token)
-        h = httplib2.Http()
-        result = json.loads(h.request(url, 'GET')[1])
+        try:
+            # Verify the ID token locally (signature, audience, expiry)
+            id_token = google_auth.verifyIdToken(
+                                credentials.token_response['id_token'])
+            # Check that access token is valid, and get the user's info
+            result, data = google_auth.profile(credentials.access_token)
+        except googleauth.GoogleAuthError as e:
+            log.warning("Google token check failed: %s", e)
+            response = make_response(json.dumps("Failed to verify tokens."),
+                                     401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
         # Check result for errors
         if result.get('error') is not None:
@@ -571,18 +1263,18 @@ def gconnect():
             return response
 
         # Verify access token is for intended user
-        gplus_id = credentials.id_token['sub']
+        gplus_id = id_token['sub']
         if result['user_id'] != gplus_id:
             response = make_response(json.dumps("""Token's user ID doesn't
                                     match given user ID."""), 401)
-            response.header['Content-Type'] = 'application/json'
+            response.headers['Content-Type'] = 'application/json'
             return response
 
         # Verify access token is valid for this app
-        if result['issued_to'] != CLIENT_ID:
+        if result['issued_to'] != catalog_config.settings.client_id:
             response = make_response(json.dumps("""Token's client ID doesn't
                                      match the app."""), 401)
-            print "Token's client ID does not match the app's."
+            log.warning("Token's client ID does not match the app's.")
             response.headers['Content-Type'] = 'application/json'
             return response
 
@@ -599,13 +1291,7 @@ def gconnect():
         login_session['credentials'] = credentials.access_token
         login_session['gplus_id'] = gplus_id
 
-        # Get Google User info
-        userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-        params = {'access_token': credentials.access_token, 'alt': 'json'}
-        answer = requests.get(userinfo_url, params=params)
-
-        data = answer.json()
-
+        # Google User info (data) was fetched along with the tokeninfo
         login_session['username'] = data['name']
         login_session['picture'] = data['picture']
         login_session['email'] = data['email']
@@ -617,8 +1303,6 @@ def gconnect():
             # Then create our User in database
             createUser(login_session)
         else:
-            print user.email
-            print data['email']
             user.email == data['email']
             # Just update our stored data in case something changed:
             user.name = data['name']
@@ -640,13 +1324,13 @@ def gdisconnect():
         return response
     else:
         # Execute GET to revoke current token
-        access_token = credentials
-        url = ("https://accounts.google.com/o/oauth2/revoke?token=%s" %
-               access_token)
-        h = httplib2.Http()
-        result = h.request(url, 'GET')[0]
+        try:
+            status = google_auth.revoke(credentials)
+        except googleauth.GoogleAuthError as e:
+            log.warning("Token revoke failed: %s", e)
+            status = None
 
-        if result['status'] == '200':
+        if status == 200:
             # Reset the user's session
             del login_session['credentials']
             del login_session['gplus_id']
@@ -661,7 +1345,7 @@ def gdisconnect():
             return response
         else:
             # Other than 200 response
-            print result['status']
+            log.warning("Token revoke failed with status %s", status)
 
             # Cleanup session variables either way, otherwise we may not be
             # able to Logout
@@ -682,7 +1366,7 @@ def gdisconnect():
 @app.route('/logout/')
 @app.route('/catalog/logout/')
 def logout():
-    print "In logout()"
+    log.debug("In logout()")
     if 'login_type' in login_session:
         if login_session['login_type'] == 'google':
             gdisconnect()
@@ -693,62 +1377,187 @@ def logout():
     return redirect(url_for('catalogHome'))
 
 
+"""
+Debug Specific
+"""
+
+
+@app.route('/debug/cache')
+def debugCache():
+    # Catalog data cache version and hit/miss counters, exposed together
+    # with /debug/metrics (INSTRUMENTATION config)
+    if not app.config['INSTRUMENTATION']:
+        abort(404)
+    return jsonify(Cache=data_cache.stats())
+
+
+"""
+Health Specific
+"""
+
+
+@app.route('/health/live')
+def healthLive():
+    # The worker is up and serving, no dependencies checked
+    return jsonify(Status="ok")
+
+
+@app.route('/health/ready')
+def healthReady():
+    # Ready for traffic once the primary and every replica answer, one
+    # pooled round trip each
+    try:
+        for checked in [engine] + replicas:
+            with checked.connect() as conn:
+                conn.execute(select([literal(1)])).scalar()
+    except exc.SQLAlchemyError as e:
+        log.warning("Readiness check failed: %s", e)
+        response = jsonify(Status="unavailable")
+        response.status_code = 503
+        return response
+    return jsonify(Status="ok")
+
+
 """ API Endpoint Specific """
 
 
+def streamJSON(name, rows):
+    """
+    Streams {name: [row, row, ...]} one array element at a time, so
+    exports never hold the whole document (or every row) in memory.
+    """
+    def generate():
+        yield '{"%s":[' % name
+        sep = ''
+        for row in rows:
+            yield sep + flask_json.dumps(row, separators=(',', ':'))
+            sep = ','
+        yield ']}\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+
+def serialSelect(*models):
+    # Core SELECT of the models' serialized columns, skips ORM hydration
+    columns = []
+    for model in models:
+        columns.extend(model._serial_columns())
+    return select(columns)
+
+
+def rowDicts(model, statement):
+    return [model._rowdict(row) for row in session.execute(statement)]
+
+
+def streamRows(statement):
+    # Page through Core rows with a server-side cursor
+    result = session.execute(
+                    statement.execution_options(stream_results=True))
+    batch = app.config['JSON_STREAM_BATCH']
+    try:
+        while True:
+            rows = result.fetchmany(batch)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        result.close()
+
+
+def groupCatalog(rows):
+    # Category + Item column rows, ordered by category, one entry per
+    # category with its items
+    split = len(Category._serial_columns())
+    categ_id = Category._serial_spec()[0].index('id')
+    item_id = split + Item._serial_spec()[0].index('id')
+    category = None
+    items = []
+    for row in rows:
+        if category is None or category['id'] != row[categ_id]:
+            if category is not None:
+                yield {'Category': category, 'Items': items}
+            category = Category._rowdict(row[:split])
+            items = []
+        # Outer join, categories without items have a NULL item id
+        if row[item_id] is not None:
+            items.append(Item._rowdict(row[split:]))
+
+    if category is not None:
+        yield {'Category': category, 'Items': items}
+
+
 # Our Entire Catalog with Items
 @app.route('/catalog.json')
+@conditional(catalogFreshness)
 def catalogJSON():
-    print "In catalogJSON()"
-
-    catalog = []
-    categories = session.query(Category).all()
-    for category in categories:
-        me = {'Category': category, 'Items': category.items}
-        catalog.append(me)
+    api_log.debug("In catalogJSON()")
 
-    return jsonify(Catalog=list(catalog))
+    rows = streamRows(serialSelect(Category, Item).select_from(
+                            Category.__table__.outerjoin(Item.__table__)).
+                      order_by(Category.id, Item.id).apply_labels())
+    return streamJSON('Catalog', groupCatalog(rows))
 
 
 # Individual API Endpoints for Entities
 @app.route('/categories.json')
 @app.route('/catalog/categories/json/')
+@conditional(categoriesFreshness)
 def categoriesJSON():
-    print "In categoriesJSON()"
+    api_log.debug("In categoriesJSON()")
 
-    categories = session.query(Category).all()
-    return jsonify(Categories=list(categories))
+    if isPaged():
+        categories, next_url = pagedRowDicts(Category,
+                                             serialSelect(Category))
+        return jsonify(Categories=categories, Next=next_url)
+
+    categories = rowDicts(Category,
+                          serialSelect(Category).order_by(Category.id))
+    return jsonify(Categories=categories)
 
 
 @app.route('/catalog/<category>/json/')
+@conditional(categoryFreshness)
 def singleCategJSON(category):
-    print "In singleCategJSON()"
+    api_log.debug("In singleCategJSON()")
 
     category = [session.query(Category).filter_by(name=category).one()]
     return jsonify(Category=list(category))
 
 
 @app.route('/catalog/<category>/items/json/')
+@conditional(categoryItemsFreshness)
 def singleCategItemsJSON(category):
-    print "In singleCategItemsJSON()"
+    api_log.debug("In singleCategItemsJSON()")
 
-    category = session.query(Category).filter_by(name=category).one()
+    # Category and its items in one query
+    items = joinedload(Category.items).lazyload(Item.category)
+    category = session.query(Category).options(items).filter_by(
+                                                      name=category).one()
     categItems = [{'Category': category, 'Items': category.items}]
     return jsonify(CategItems=list(categItems))
 
 
 @app.route('/items.json')
 @app.route('/catalog/items/json/')
+@conditional(itemsFreshness)
 def itemsJSON():
-    print "In itemsJSON()"
+    api_log.debug("In itemsJSON()")
+
+    if isPaged():
+        items, next_url = pagedRowDicts(Item, serialSelect(Item))
+        return jsonify(Items=items, Next=next_url)
 
-    items = session.query(Item).all()
-    return jsonify(Items=list(items))
+    items = (Item._rowdict(row) for row in streamRows(
+                                serialSelect(Item).order_by(Item.id)))
+    return streamJSON('Items', items)
 
 
 @app.route('/catalog/<category>/<item>/json/')
+@conditional(itemFreshness)
 def singleItemJSON(category, item):
-    print "In singleItemJSON()"
+    api_log.debug("In singleItemJSON()")
 
     curr_categ = session.query(Category).filter(
                                                Category.name == category).one()
@@ -760,32 +1569,228 @@ def singleItemJSON(category, item):
 @app.route('/login-types.json')
 @app.route('/catalog/login-types/json/')
 def loginTypesJSON():
-    print "In loginTypesJSON()"
+    api_log.debug("In loginTypesJSON()")
 
-    login_types = session.query(LoginType).all()
-    return jsonify(LoginTypes=list(login_types))
+    login_types = rowDicts(LoginType,
+                           serialSelect(LoginType).order_by(LoginType.id))
+    return jsonify(LoginTypes=login_types)
 
 
 @app.route('/roles.json')
 @app.route('/catalog/roles/json/')
 def rolesJSON():
-    print "In rolesJSON()"
+    api_log.debug("In rolesJSON()")
 
-    roles = session.query(Role).all()
-    return jsonify(Roles=list(roles))
+    roles = rowDicts(Role, serialSelect(Role).order_by(Role.id))
+    return jsonify(Roles=roles)
 
 
 @app.route('/users.json')
 @app.route('/catalog/users/json/')
 def usersJSON():
-    print "In usersJSON()"
+    api_log.debug("In usersJSON()")
+
+    if isPaged():
+        users, next_url = pagedRowDicts(User, serialSelect(User))
+        return jsonify(Users=users, Next=next_url)
+
+    users = rowDicts(User, serialSelect(User).order_by(User.id))
+    return jsonify(Users=users)
+
+
+@app.route('/search.json')
+@app.route('/catalog/search/json/')
+def searchJSON():
+    api_log.debug("In searchJSON()")
+
+    words = searchWords(request.args.get('q'))
+    if not words:
+        return jsonify(Categories=[], Items=[], Next=None)
+
+    categories = searchCategories(words)
+    items, next_url = searchPage(session.query(Item).options(
+                                     lazyload(Item.category)), Item, words)
+    return jsonify(Categories=categories,
+                   Items=[item for item, rank in items], Next=next_url)
+
+
+"""
+Feed Specific
+"""
+
+
+def feedEntry(entry):
+    # Activity entry as served, None for the deleted items' links
+    entry = dict(entry)
+    entry['url'] = None if entry['action'] == 'delete' else url_for(
+                    'itemInfo', category=entry['category_name'],
+                    item=entry['item_name'], _external=True)
+    return entry
+
+
+@app.route('/catalog/feed.json')
+def activityJSON():
+    """
+    Item activity, oldest first after ?since=<seq> (the Cursor of the
+    previous response), or the newest ?limit= entries without it.
+    """
+    api_log.debug("In activityJSON()")
+
+    since = parseArg('since', int)
+    limit = parseArg('limit', int, app.config['FEED_PAGE_SIZE'])
+    limit = max(1, min(limit, app.config['MAX_FEED_PAGE_SIZE']))
+    cursor = activity_feed.refresh(session)
+    if since is None:
+        entries, truncated = activity_feed.latest(limit)[::-1], False
+    else:
+        entries, truncated = activity_feed.since(since, limit)
+        if entries:
+            cursor = entries[-1]['seq']
+        else:
+            cursor = max(since, cursor)
+
+    response = jsonify(Activity=[feedEntry(entry) for entry in entries],
+                       Cursor=cursor, Truncated=truncated)
+    response.set_etag('feed-%d-%s-%d' % (cursor, since, limit))
+    return response.make_conditional(request)
+
+
+@app.route('/catalog/feed.atom')
+def activityAtom():
+    api_log.debug("In activityAtom()")
 
-    users = session.query(User).all()
-    return jsonify(Users=list(users))
+    activity_feed.refresh(session)
+    entries = [feedEntry(entry) for entry
+               in activity_feed.latest(app.config['FEED_PAGE_SIZE'])]
+    for entry in entries:
+        # RFC 3339, as Atom requires
+        entry['updated'] = toUTC(entry['at']).strftime('%Y-%m-%dT%H:%M:%SZ')
+    response = make_response(render_template(
+                    "feed.atom", entries=entries,
+                    updated=entries[0]['updated'] if entries else
+                    datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')))
+    response.mimetype = 'application/atom+xml'
+    response.set_etag('feed-%d' % activity_feed.last_seq)
+    return response.make_conditional(request)
+
+
+"""
+Sync Specific
+"""
+
+
+@app.route('/catalog/changes')
+@app.route('/changes.json')
+def catalogChanges():
+    """
+    Categories and items changed after ?since=<seq> (0 or none for the
+    whole catalog), oldest change first, at most ?limit= of them. Deleted
+    ones come back as tombstones. Poll again with Cursor, or follow Next
+    while there are more.
+    """
+    api_log.debug("In catalogChanges()")
+
+    since = max(parseArg('since', int, 0), 0)
+    limit = parseArg('limit', int, app.config['MAX_PAGE_SIZE'])
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    logged = session.execute(select([change_table]).where(
+                    change_table.c.seq > since).order_by(
+                    change_table.c.seq).limit(limit + 1)).fetchall()
+    more = len(logged) > limit
+    logged = logged[:limit]
+
+    # Current rows of the upserted entities, one query per entity
+    current = {}
+    for entity, model in CHANGE_ENTITIES.items():
+        ids = [change.entity_id for change in logged
+               if change.entity == entity and change.op == 'upsert']
+        current[entity] = dict(
+                    (row['id'], row) for row in rowDicts(
+                        model, serialSelect(model).where(model.id.in_(ids)))
+                    ) if ids else {}
+
+    changes = []
+    for change in logged:
+        entry = {'seq': change.seq, 'entity': change.entity,
+                 'id': change.entity_id, 'op': change.op}
+        if change.op == 'upsert':
+            entry['data'] = current[change.entity].get(change.entity_id)
+            if entry['data'] is None:
+                # Deleted meanwhile, its tombstone follows
+                continue
+        changes.append(entry)
+
+    cursor = logged[-1].seq if logged else since
+    next_url = url_for('catalogChanges', since=cursor, limit=limit) \
+        if more else None
+    return jsonify(Changes=changes, Cursor=cursor, Next=next_url)
+
+
+# Bulk import/export (see bulk.py), NDJSON or CSV
+@app.route('/catalog/import/', methods=['POST'])
+def bulkImport():
+    api_log.debug("In bulkImport()")
+    if 'email' not in login_session:
+        abort(401)
+
+    user = getUser(login_session['login_type'], login_session['email'])
+    auth = getAppAuth()
+    if user is None or auth['roles']['admin'] is False:
+        abort(403)
+
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in bulk.PARSERS:
+        abort(400)
+
+    try:
+        stats = bulk.importRecords(session,
+                                   bulk.PARSERS[fmt](request.stream),
+                                   user_id=user.id)
+        # Core statements skip the flush events, bump the data cache here
+        session.info['catalog_changed'] = True
+        session.commit()
+    except (bulk.BulkImportError, exc.IntegrityError) as e:
+        session.rollback()
+        api_log.warning("Bulk import failed: %s", e)
+        response = jsonify(Error=unicode(e))
+        response.status_code = 400
+        return response
+
+    return jsonify(Imported=stats)
+
+
+@app.route('/catalog/export.<any(ndjson, csv):fmt>')
+@conditional(exportFreshness)
+def bulkExport(fmt):
+    api_log.debug("In bulkExport()")
+
+    records = bulk.exportRecords(session, app.config['JSON_STREAM_BATCH'])
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(bulk.FORMATTERS[fmt](records)),
+                    mimetype=mimetype)
+
+
+def create_app(overrides=None):
+    """
+    Returns the app, configured for serving (see wsgi.py). Settings read
+    while this module is imported come from CATALOG_SETTINGS and the
+    environment, overrides only updates app.config afterwards.
+    """
+    if overrides:
+        app.config.update(overrides)
+    if app.secret_key is None and \
+            app.config['SESSION_BACKEND'] == 'cookie':
+        raise config.ConfigError("Cookie sessions need CATALOG_SECRET_KEY")
+    return app
 
 
 if __name__ == '__main__':
-    app.secret_key = "secret"
+    # Development server, see wsgi.py / gunicorn.conf.py for production.
+    # Development default, set CATALOG_SECRET_KEY anywhere else
+    if app.secret_key is None:
+        app.secret_key = "secret"
     app.template_folder = 'templates'
     app.debug = True
     app.run(host='0.0.0.0', port=9090)
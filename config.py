@@ -0,0 +1,176 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Configuration loader for the Catalog App, everything is read once at
+startup (and on SIGHUP), never per request:
+    - OAuth client settings from client_secrets.json (CATALOG_CLIENT_SECRETS
+      for another path), GOOGLE_CLIENT_ID / GOOGLE_CLIENT_SECRET override
+    - the Flask secret key from CATALOG_SECRET_KEY or the file named by
+      CATALOG_SECRET_KEY_FILE
+    - the database URL from CATALOG_DATABASE_URL and read replica URLs
+      from CATALOG_REPLICA_URLS (see database_setup.py)
+Settings are validated as they load, a bad reload keeps the old ones.
+"""
+
+import os
+import json
+import signal
+import logging
+import threading
+
+from sqlalchemy.engine.url import make_url
+from oauth2client.client import OAuth2WebServerFlow
+
+log = logging.getLogger('catalog.config')
+
+OAUTH_URIS = ('auth_uri', 'token_uri')
+
+
+class ConfigError(Exception):
+    pass
+
+
+class Settings(object):
+    """
+    One validated snapshot of the settings. flow() builds the OAuth flow
+    for gconnect from them, without touching the file system.
+    """
+    def __init__(self, client_id, client_secret, auth_uri, token_uri,
+                 revoke_uri=None, secret_key=None, database_url=None,
+                 replica_urls=()):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.auth_uri = auth_uri
+        self.token_uri = token_uri
+        self.revoke_uri = revoke_uri
+        self.secret_key = secret_key
+        self.database_url = database_url
+        self.replica_urls = tuple(replica_urls)
+
+    def flow(self):
+        # A new flow per login, flows carry per-exchange state
+        kwargs = {'auth_uri': self.auth_uri, 'token_uri': self.token_uri}
+        if self.revoke_uri:
+            kwargs['revoke_uri'] = self.revoke_uri
+        return OAuth2WebServerFlow(self.client_id, self.client_secret,
+                                   scope='', redirect_uri='postmessage',
+                                   **kwargs)
+
+
+def _read(path, what):
+    try:
+        with open(path) as f:
+            return f.read()
+    except IOError as e:
+        raise ConfigError("Cannot read %s %s: %s" % (what, path, e))
+
+
+def load(environ=None):
+    """
+    Reads and validates the settings, raises ConfigError if they are
+    missing or malformed.
+    """
+    environ = os.environ if environ is None else environ
+
+    path = environ.get('CATALOG_CLIENT_SECRETS', 'client_secrets.json')
+    try:
+        secrets = json.loads(_read(path, 'client secrets'))
+        client = secrets.get('web') or secrets['installed']
+    except (ValueError, KeyError, AttributeError):
+        raise ConfigError("%s is not a Google client secrets file" % path)
+
+    client_id = environ.get('GOOGLE_CLIENT_ID', client.get('client_id'))
+    client_secret = environ.get('GOOGLE_CLIENT_SECRET',
+                                client.get('client_secret'))
+    if not client_id or not client_secret:
+        raise ConfigError("OAuth client_id and client_secret are required")
+    for key in OAUTH_URIS:
+        if not (client.get(key) or '').startswith(('https://', 'http://')):
+            raise ConfigError("OAuth %s must be an http(s) URL" % key)
+
+    secret_key = environ.get('CATALOG_SECRET_KEY')
+    if secret_key is None and environ.get('CATALOG_SECRET_KEY_FILE'):
+        secret_key = _read(environ['CATALOG_SECRET_KEY_FILE'],
+                           'secret key').strip()
+    if secret_key is not None and len(secret_key) < 16:
+        raise ConfigError("The secret key must be at least 16 characters")
+
+    database_url = environ.get('CATALOG_DATABASE_URL')
+    if database_url:
+        try:
+            make_url(database_url)
+        except Exception:
+            raise ConfigError("CATALOG_DATABASE_URL is not a database URL")
+
+    replica_urls = [url.strip() for url
+                    in environ.get('CATALOG_REPLICA_URLS', '').split(',')
+                    if url.strip()]
+    for url in replica_urls:
+        try:
+            make_url(url)
+        except Exception:
+            raise ConfigError("CATALOG_REPLICA_URLS has an invalid database "
+                              "URL")
+
+    return Settings(client_id, client_secret, client['auth_uri'],
+                    client['token_uri'], client.get('revoke_uri'),
+                    secret_key, database_url, replica_urls)
+
+
+class Loader(object):
+    """
+    Holds the current Settings. reload() swaps in freshly loaded ones and
+    calls the on_reload callbacks with them, watch() reloads on a signal.
+    """
+    def __init__(self, environ=None):
+        self.environ = environ
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.settings = load(environ)
+
+    def on_reload(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def reload(self):
+        try:
+            settings = load(self.environ)
+        except ConfigError as e:
+            log.error("Config reload failed, keeping the current settings: "
+                      "%s", e)
+            return False
+
+        with self.lock:
+            previous, self.settings = self.settings, settings
+        if settings.database_url != previous.database_url or \
+                settings.replica_urls != previous.replica_urls:
+            log.warning("The database URLs changed, they apply on restart")
+        for callback in self.callbacks:
+            callback(settings)
+        log.info("Config reloaded")
+        return True
+
+    def watch(self, signum=signal.SIGHUP):
+        # Signal handlers can only be set from the main thread
+        if threading.current_thread().name != 'MainThread':
+            return False
+        signal.signal(signum, lambda signum, frame: self.reload())
+        return True
+
+
+def init_app(app, environ=None):
+    """
+    Loads the settings, applies the secret key (if configured) to the app
+    and reloads everything on SIGHUP. Returns the Loader.
+    """
+    loader = Loader(environ)
+
+    @loader.on_reload
+    def applySecretKey(settings):
+        if settings.secret_key is not None:
+            app.secret_key = settings.secret_key
+
+    applySecretKey(loader.settings)
+    loader.watch()
+    return loader
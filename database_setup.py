@@ -6,18 +6,25 @@ Database Schema/Models
     -ver 0.1 - 05/2017
 """
 
+import os
 import sys
+import argparse
 import datetime
 import getpass
+import threading
 
 from collections import OrderedDict
+from operator import attrgetter
 
 from sqlalchemy import (Column, ForeignKey, Integer, String, Text,
-                        DateTime, Enum, UniqueConstraint, create_engine)
-from sqlalchemy.engine.url import URL
+                        DateTime, Enum, UniqueConstraint, Index, DDL, event,
+                        create_engine, inspect)
+from sqlalchemy.engine.url import URL, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref
-from sqlalchemy.sql import func
+from sqlalchemy.orm import (relationship, backref, deferred, column_property,
+                            configure_mappers)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.sql import func, select, literal, true, and_
 from sqlalchemy.schema import Table
 
 DATABASE = {
@@ -29,6 +36,71 @@ DATABASE = {
     'database': 'udacity_catalog'
 }
 
+# Connection pool tuning for the app engine(s), passed to create_engine()
+#   - pool_size: connections kept open per process
+#   - max_overflow: extra connections allowed above pool_size under load
+#   - pool_recycle: seconds before a connection is replaced (avoids stale
+#     connections dropped by the server/firewall)
+#   - pool_pre_ping: test connections on checkout, reconnect if needed
+DATABASE_POOL = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True
+}
+
+
+def databaseURL():
+    # CATALOG_DATABASE_URL (e.g. a benchmark database, or sqlite:///x.db
+    # for a local run) overrides DATABASE
+    url = os.environ.get('CATALOG_DATABASE_URL')
+    return make_url(url) if url else URL(**DATABASE)
+
+
+def poolOptions(url):
+    # SQLite picks its own pool class, which takes no sizing options
+    return {} if url.drivername.startswith('sqlite') else DATABASE_POOL
+
+
+def replicaURLs():
+    # CATALOG_REPLICA_URLS, comma separated read replica URLs, e.g. two
+    # sqlite:///x.db copies for a local run
+    urls = os.environ.get('CATALOG_REPLICA_URLS', '')
+    return [make_url(url.strip()) for url in urls.split(',') if url.strip()]
+
+
+_engine = None
+_replicas = None
+_engine_lock = threading.Lock()
+
+
+def getEngine():
+    """
+    The process' engine for databaseURL() with DATABASE_POOL, created on
+    first use. Creating it opens no connection, the pool connects on the
+    first query, so importing the models never needs the database.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = databaseURL()
+            _engine = create_engine(url, **poolOptions(url))
+        return _engine
+
+
+def getReplicaEngines():
+    """
+    The process' read replica engines for replicaURLs(), [] when none are
+    configured. Created on first use and connecting lazily, as getEngine().
+    """
+    global _replicas
+    with _engine_lock:
+        if _replicas is None:
+            _replicas = [create_engine(url, **poolOptions(url))
+                         for url in replicaURLs()]
+        return _replicas
+
+
 Base = declarative_base()
 
 
@@ -41,13 +113,41 @@ class SerializableOrdered(object):
     # SerializableOrdered class based off of example using OrderedDict
     # found here: http://piotr.banaszkiewicz.org/blog/2012/06/30
     # /serialize-sqlalchemy-results-into-json/
+    # Column keys, Columns and an attrgetter for them are resolved once
+    # per model and cached on the class
+    @classmethod
+    def _serial_spec(cls):
+        spec = cls.__dict__.get('_serial_spec_cache')
+        if spec is None:
+            keys = tuple(key for key, column
+                         in cls.__mapper__.columns.items()
+                         if column.info.get('serialize', True))
+            columns = tuple(cls.__mapper__.columns[key] for key in keys)
+            getter = attrgetter(*keys)
+            if len(keys) == 1:
+                # attrgetter of a single key returns a bare value
+                getter = (lambda get: lambda obj: (get(obj),))(getter)
+            spec = (keys, columns, getter)
+            cls._serial_spec_cache = spec
+        return spec
+
+    # Columns to select() so Core rows can be passed to _rowdict()
+    @classmethod
+    def _serial_columns(cls):
+        return list(cls._serial_spec()[1])
+
+    # Serializable format of a Core row of _serial_columns() values,
+    # identical to _asdict() of the matching ORM object
+    @classmethod
+    def _rowdict(cls, row):
+        return OrderedDict(zip(cls._serial_spec()[0], row))
+
     # Returns data in serializable format
     def _asdict(self):
-        my_dict = OrderedDict()
-        for key in self.__mapper__.columns.keys():
-            my_dict[key] = getattr(self, key)
-        # print my_dict
-        return my_dict
+        spec = self._serial_spec()
+        keys = spec[0]
+        getter = spec[2]
+        return OrderedDict(zip(keys, getter(self)))
 
 
 """
@@ -55,6 +155,13 @@ Schema Models
 """
 
 
+def searchVectorColumn():
+    # Full text search document of name + description, maintained by the
+    # database (see searchDDL()), never serialized
+    return Column(TSVECTOR().with_variant(Text, 'sqlite'),
+                  info={'serialize': False})
+
+
 class LoginType(Base, SerializableOrdered):
     # Initial allowable login value is only "Google"
     # Can expand this enum type later (e.g. Facebook, LinkedIn, etc...)
@@ -70,13 +177,21 @@ class Category(Base, SerializableOrdered):
     name = Column(String(80), nullable=False, unique=True)
     description = Column(Text, nullable=False)
 
-    created_by = Column(Integer, ForeignKey('user.id'))
+    created_by = Column(Integer, ForeignKey('user.id'), index=True)
     created = Column(DateTime(timezone=True), server_default=func.now())
-    last_update_by = Column(Integer, ForeignKey('user.id'))
+    last_update_by = Column(Integer, ForeignKey('user.id'), index=True)
     updated = Column(DateTime(timezone=True), onupdate=func.now())
+    search_vector = deferred(searchVectorColumn())
+    # Number of items, kept up to date on every item write (see Item
+    # counts below)
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
 
-    items = relationship("Item", order_by="Item.id",
-                         backref=backref("category", lazy="joined"))
+    # Items are removed with the category by a set based delete (and the
+    # FK's ON DELETE CASCADE), never loaded just to be deleted
+    items = relationship("Item", order_by="Item.id", passive_deletes=True,
+                         backref=backref("category", lazy="joined",
+                                         active_history=True))
 
 
 class Item(Base, SerializableOrdered):
@@ -89,15 +204,121 @@ class Item(Base, SerializableOrdered):
     name = Column(String(80), nullable=False)
     description = Column(Text, nullable=False)
 
-    created_by = Column(Integer, ForeignKey('user.id'))
+    created_by = Column(Integer, ForeignKey('user.id'), index=True)
     created = Column(DateTime(timezone=True), server_default=func.now())
-    last_update_by = Column(Integer, ForeignKey('user.id'))
+    last_update_by = Column(Integer, ForeignKey('user.id'), index=True)
     updated = Column(DateTime(timezone=True), onupdate=func.now())
-
-    category_id = Column(Integer, ForeignKey('category.id'), nullable=False)
+    search_vector = deferred(searchVectorColumn())
+
+    # No separate index needed, category_id leads the categ_itemname
+    # unique index which also serves (category_id, name) lookups
+    # active_history: a move must know the old category (item_count)
+    category_id = column_property(
+                    Column(Integer,
+                           ForeignKey('category.id', ondelete='CASCADE'),
+                           nullable=False),
+                    active_history=True)
     # category = relationship("Category")
 
 
+# Latest/ALL items pages read newest first, keyset on (created, id)
+Index('ix_item_created_desc', Item.created.desc(), Item.id.desc())
+
+
+"""
+Item counts
+"""
+
+
+def _countItems(connection, category_id, delta):
+    # Atomic in the flush's transaction. Also sets category.updated (its
+    # onupdate), so cached/conditional category responses are refreshed,
+    # and logs the category as changed for sync clients.
+    category = Category.__table__
+    connection.execute(category.update().where(
+                    category.c.id == category_id).values(
+                    item_count=category.c.item_count + delta))
+    logChange(connection, 'category', category_id, 'upsert')
+
+
+@event.listens_for(Item, 'after_insert')
+def _itemInserted(mapper, connection, target):
+    _countItems(connection, target.category_id, 1)
+
+
+@event.listens_for(Item, 'after_delete')
+def _itemDeleted(mapper, connection, target):
+    _countItems(connection, target.category_id, -1)
+
+
+@event.listens_for(Item, 'after_update')
+def _itemMoved(mapper, connection, target):
+    # An item moved by setting either category_id or category
+    state = inspect(target)
+    previous = set(state.attrs.category_id.history.deleted or ())
+    previous.update(categ.id for categ
+                    in state.attrs.category.history.deleted or ()
+                    if categ is not None)
+    previous.discard(None)
+    previous.discard(target.category_id)
+    for category_id in previous:
+        _countItems(connection, category_id, -1)
+    if previous:
+        _countItems(connection, target.category_id, 1)
+
+
+def refreshItemCounts(bind, category_ids=None, log=True):
+    """
+    Recounts item_count of the given categories (all when None) from the
+    item table, and logs them as changed unless log is False. Core/bulk
+    item writes bypass the ORM events above and call this for the
+    categories they touched.
+    """
+    category = Category.__table__
+    item = Item.__table__
+    statement = category.update().values(item_count=select(
+                    [func.count(item.c.id)]).where(
+                    item.c.category_id == category.c.id).as_scalar())
+    if category_ids is not None:
+        if not category_ids:
+            return
+        statement = statement.where(category.c.id.in_(list(category_ids)))
+    bind.execute(statement)
+    if log:
+        logBulkChanges(bind, 'category', 'upsert',
+                       true() if category_ids is None
+                       else category.c.id.in_(list(category_ids)))
+
+
+"""
+Full text search (PostgreSQL)
+"""
+
+SEARCH_TABLES = ('category', 'item')
+SEARCH_CONFIG = 'pg_catalog.english'
+
+
+def searchDDL(table):
+    """
+    GIN index and trigger keeping search_vector up to date on every
+    insert/update, bulk (COPY, Core) writes included. Safe to re-run.
+    """
+    return [
+        "CREATE INDEX IF NOT EXISTS ix_%s_search ON %s "
+        "USING gin (search_vector)" % (table, table),
+        "DROP TRIGGER IF EXISTS %s_search_update ON %s" % (table, table),
+        "CREATE TRIGGER %s_search_update BEFORE INSERT OR UPDATE OF "
+        "name, description ON %s FOR EACH ROW EXECUTE PROCEDURE "
+        "tsvector_update_trigger(search_vector, '%s', name, description)" %
+        (table, table, SEARCH_CONFIG)]
+
+
+for _table in SEARCH_TABLES:
+    for _statement in searchDDL(_table):
+        event.listen(Base.metadata.tables[_table], 'after_create',
+                     DDL(_statement).execute_if(dialect='postgresql'))
+
+
 """
 User/Role specific Models
 """
@@ -110,12 +331,14 @@ user_role_association = Table('user_role_association', Base.metadata,
                                      primary_key=True),
                               Column('role_id', Integer(),
                                      ForeignKey('role.id'),
-                                     primary_key=True))
+                                     primary_key=True,
+                                     index=True))
 
 
 class User(Base, SerializableOrdered):
     __tablename__ = 'user'
-    # explicit/composite unique constraint
+    # explicit/composite unique constraint, its index also serves the
+    # (logintype_id, email) login lookup
     __table_args__ = (
         UniqueConstraint('email', 'logintype_id', name='email_logintype'),
     )
@@ -141,5 +364,340 @@ class Role(Base, SerializableOrdered):
                          order_by="User.id")
 
 
-engine = create_engine(URL(**DATABASE))
-Base.metadata.create_all(engine)
+# Set up the backrefs (e.g. Item.category) now, not on the first query, so
+# class level attributes work in a fresh process before any query ran
+configure_mappers()
+
+
+"""
+Server-side sessions
+"""
+
+
+# Login sessions (see sessions.py), the cookie only holds the sid. Expired
+# rows are swept by their (indexed) expiry time.
+session_table = Table('login_session', Base.metadata,
+                      Column('sid', String(64), primary_key=True),
+                      Column('data', Text, nullable=False),
+                      Column('expires', DateTime, nullable=False,
+                             index=True))
+
+
+"""
+Item activity
+"""
+
+# Newest item_activity rows kept, older ones are trimmed every
+# ACTIVITY_TRIM_EVERY recorded writes
+ACTIVITY_SIZE = 1000
+ACTIVITY_TRIM_EVERY = 100
+# PostgreSQL advisory lock key shared by the writers of the seq ordered
+# logs (see lockLogs())
+LOG_LOCK_KEY = 7261
+
+# Recent item creates, updates and deletes in seq order, with who did it.
+# Names are copied at write time, so entries of deleted items still read.
+activity_table = Table('item_activity', Base.metadata,
+                       Column('seq', Integer, primary_key=True),
+                       Column('action', String(10), nullable=False),
+                       Column('item_id', Integer, nullable=False),
+                       Column('item_name', String(80), nullable=False),
+                       Column('category_id', Integer, nullable=False),
+                       Column('category_name', String(80)),
+                       Column('user_id', Integer),
+                       Column('at', DateTime(timezone=True),
+                              server_default=func.now()),
+                       sqlite_autoincrement=True)
+
+
+def lockLogs(connection):
+    """
+    PostgreSQL: serializes writers of the seq ordered logs until their
+    transaction ends, so rows commit in seq order and a reader polling for
+    seq > cursor never skips one that committed late. SQLite writers are
+    serialized already.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(select([func.pg_advisory_xact_lock(LOG_LOCK_KEY)]))
+
+
+def trimActivity(connection):
+    newest = select([func.max(activity_table.c.seq)]).as_scalar()
+    connection.execute(activity_table.delete().where(
+                    activity_table.c.seq <= newest - ACTIVITY_SIZE))
+
+
+def _recordActivity(connection, action, target, user_id):
+    category = Category.__table__
+    lockLogs(connection)
+    seq = connection.execute(activity_table.insert().values(
+                    action=action, item_id=target.id, item_name=target.name,
+                    category_id=target.category_id,
+                    category_name=select([category.c.name]).where(
+                        category.c.id == target.category_id).as_scalar(),
+                    user_id=user_id)).inserted_primary_key[0]
+    if seq % ACTIVITY_TRIM_EVERY == 0:
+        trimActivity(connection)
+
+
+@event.listens_for(Item, 'after_insert')
+def _itemCreatedActivity(mapper, connection, target):
+    _recordActivity(connection, 'create', target, target.created_by)
+
+
+@event.listens_for(Item, 'after_update')
+def _itemUpdatedActivity(mapper, connection, target):
+    # Also called for items flushed without any column change
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes()
+           for key in ('name', 'description', 'category_id')):
+        _recordActivity(connection, 'update', target,
+                        target.last_update_by)
+
+
+@event.listens_for(Item, 'after_delete')
+def _itemDeletedActivity(mapper, connection, target):
+    # The deleting route sets last_update_by to the user deleting it
+    _recordActivity(connection, 'delete', target, target.last_update_by)
+
+
+def recordBulkActivity(connection, action, criterion, user_id=None,
+                       limit=None):
+    """
+    Records action (a string, or a SQL expression of the item row) for
+    every item matching criterion, for Core/bulk writes which bypass the
+    ORM events. user_id None records each item's last_update_by or
+    created_by. limit records only the newest that many items.
+    """
+    item = Item.__table__
+    category = Category.__table__
+    if not hasattr(action, 'compile'):
+        action = literal(action, String)
+    user = func.coalesce(item.c.last_update_by, item.c.created_by) \
+        if user_id is None else literal(user_id, Integer)
+    stamp = func.coalesce(item.c.updated, item.c.created)
+    rows = select([action.label('action'), item.c.id, item.c.name,
+                   item.c.category_id, category.c.name.label('categ'),
+                   user.label('user_id'), stamp.label('at')]).select_from(
+                    item.join(category, item.c.category_id == category.c.id)
+                    ).where(criterion)
+    if limit is not None:
+        rows = rows.order_by(stamp.desc(), item.c.id.desc()).limit(limit)
+    rows = rows.alias('recorded')
+    lockLogs(connection)
+    connection.execute(activity_table.insert().from_select(
+                    ['action', 'item_id', 'item_name', 'category_id',
+                     'category_name', 'user_id', 'at'],
+                    select([rows.c.action, rows.c.id, rows.c.name,
+                            rows.c.category_id, rows.c.categ,
+                            rows.c.user_id, rows.c.at]).order_by(
+                        rows.c.at, rows.c.id)))
+    trimActivity(connection)
+
+
+"""
+Change log
+"""
+
+# The newest change of every category and item in seq order, deletes kept
+# as tombstones. An entity's older row is removed as it changes again, so
+# the log grows with the catalog, not with the number of writes. Sync
+# clients read it from a cursor (see catalogChanges in catalog.py).
+change_table = Table('change_log', Base.metadata,
+                     Column('seq', Integer, primary_key=True),
+                     Column('entity', String(10), nullable=False),
+                     Column('entity_id', Integer, nullable=False),
+                     Column('op', String(10), nullable=False),
+                     Column('at', DateTime(timezone=True),
+                            server_default=func.now()),
+                     Index('ix_change_log_entity', 'entity', 'entity_id'),
+                     sqlite_autoincrement=True)
+
+# change_log entity names and their models
+CHANGE_ENTITIES = {'category': Category, 'item': Item}
+
+
+def logChange(connection, entity, entity_id, op):
+    # op is 'upsert' or 'delete'
+    lockLogs(connection)
+    connection.execute(change_table.delete().where(and_(
+                    change_table.c.entity == entity,
+                    change_table.c.entity_id == entity_id)))
+    connection.execute(change_table.insert().values(
+                    entity=entity, entity_id=entity_id, op=op))
+
+
+def logBulkChanges(connection, entity, op, criterion):
+    """
+    Logs op for every entity row matching criterion, for Core/bulk writes
+    which bypass the ORM events. Deletes must be logged before the rows
+    are deleted.
+    """
+    table = CHANGE_ENTITIES[entity].__table__
+    lockLogs(connection)
+    connection.execute(change_table.delete().where(and_(
+                    change_table.c.entity == entity,
+                    change_table.c.entity_id.in_(
+                        select([table.c.id]).where(criterion)))))
+    connection.execute(change_table.insert().from_select(
+                    ['entity', 'entity_id', 'op'],
+                    select([literal(entity, String), table.c.id,
+                            literal(op, String)]).where(criterion).order_by(
+                        table.c.id)))
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Item, 'after_insert')
+def _logInsert(mapper, connection, target):
+    logChange(connection, mapper.local_table.name, target.id, 'upsert')
+
+
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Item, 'after_update')
+def _logUpdate(mapper, connection, target):
+    # Also called for objects flushed without any column change
+    state = inspect(target)
+    if any(state.attrs[attr.key].history.has_changes()
+           for attr in mapper.column_attrs):
+        logChange(connection, mapper.local_table.name, target.id, 'upsert')
+
+
+@event.listens_for(Category, 'after_delete')
+@event.listens_for(Item, 'after_delete')
+def _logDelete(mapper, connection, target):
+    logChange(connection, mapper.local_table.name, target.id, 'delete')
+
+
+def upgradeIndexes(bind):
+    """
+    create_all() only creates missing tables. Adds any declared index that
+    an existing database (e.g. one created before the index was added to
+    the models) is missing, returns the names of the indexes created.
+    """
+    inspector = inspect(bind)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = set(index['name']
+                       for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind)
+                created.append(index.name)
+    return created
+
+
+def upgradeSearch(bind):
+    """
+    Adds the search_vector column to tables created before it existed,
+    then (PostgreSQL) its index and trigger, and fills it in for existing
+    rows. Returns a description of each change made.
+    """
+    inspector = inspect(bind)
+    postgres = bind.dialect.name == 'postgresql'
+    changes = []
+    for table in SEARCH_TABLES:
+        columns = set(column['name']
+                      for column in inspector.get_columns(table))
+        if 'search_vector' in columns:
+            continue
+        bind.execute("ALTER TABLE %s ADD COLUMN search_vector %s" %
+                     (table, 'tsvector' if postgres else 'text'))
+        changes.append("Added column %s.search_vector" % table)
+        if postgres:
+            for statement in searchDDL(table):
+                bind.execute(statement)
+            bind.execute(
+                "UPDATE %s SET search_vector = to_tsvector('%s', "
+                "coalesce(name, '') || ' ' || coalesce(description, ''))" %
+                (table, SEARCH_CONFIG))
+            changes.append("Indexed and filled in %s.search_vector" % table)
+    return changes
+
+
+def upgradeItemCounts(bind):
+    """
+    Adds category.item_count to tables created before it existed and
+    fills it in. Returns a description of each change made.
+    """
+    columns = set(column['name']
+                  for column in inspect(bind).get_columns('category'))
+    if 'item_count' in columns:
+        return []
+    bind.execute("ALTER TABLE category ADD COLUMN item_count INTEGER "
+                 "NOT NULL DEFAULT 0")
+    # upgradeChangeLog() logs every category while the log is empty
+    refreshItemCounts(bind, log=False)
+    return ["Added and filled in column category.item_count"]
+
+
+def upgradeActivity(bind):
+    """
+    Creates item_activity on databases from before it existed and, while
+    it is empty, seeds it with the newest ACTIVITY_SIZE items. Returns a
+    description of each change made.
+    """
+    changes = []
+    if activity_table.name not in inspect(bind).get_table_names():
+        activity_table.create(bind)
+        changes.append("Created table item_activity")
+    if bind.execute(select([activity_table.c.seq]).limit(1)).first() is None \
+            and bind.execute(select([Item.id]).limit(1)).first() is not None:
+        recordBulkActivity(bind, 'create', true(), limit=ACTIVITY_SIZE)
+        changes.append("Filled in table item_activity")
+    return changes
+
+
+def upgradeChangeLog(bind):
+    """
+    Creates change_log on databases from before it existed and, while it
+    is empty, logs every existing category and item. Returns a description
+    of each change made.
+    """
+    changes = []
+    if change_table.name not in inspect(bind).get_table_names():
+        change_table.create(bind)
+        changes.append("Created table change_log")
+    if bind.execute(select([change_table.c.seq]).limit(1)).first() is None:
+        for entity in ('category', 'item'):
+            logBulkChanges(bind, entity, 'upsert', true())
+        if bind.execute(select([change_table.c.seq]).limit(1)).first():
+            changes.append("Filled in table change_log")
+    return changes
+
+
+def createSchema(bind):
+    # Creates any missing table (with its indexes, trigger, ...)
+    Base.metadata.create_all(bind)
+
+
+def upgradeSchema(bind):
+    # Brings tables created by an older version up to date, returns what
+    # was changed
+    changes = upgradeSearch(bind)
+    changes.extend(upgradeItemCounts(bind))
+    changes.extend(upgradeActivity(bind))
+    changes.extend(upgradeChangeLog(bind))
+    changes.extend("Created index %s" % name
+                   for name in upgradeIndexes(bind))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalog database schema")
+    parser.add_argument('command', nargs='?', default='create',
+                        choices=['create', 'upgrade'],
+                        help="create: missing tables, then upgrade (the "
+                             "default). upgrade: only add what older "
+                             "tables lack")
+    args = parser.parse_args(argv)
+
+    engine = getEngine()
+    if args.command == 'create':
+        createSchema(engine)
+    for change in upgradeSchema(engine):
+        print change
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Template caching for the Catalog App:
+    - Jinja bytecode cached on disk (TEMPLATE_CACHE_DIR), so a new worker
+      loads compiled templates instead of parsing them again
+    - {% cache %} fragments, rendered markup kept in the catalog data
+      cache, e.g.:
+          {% cache 'sidebar', is_admin == True %} ... {% endcache %}
+      The name and values after it form the key, the data version is
+      added by the VersionedCache, so any catalog write re-renders them.
+"""
+
+import os
+import tempfile
+
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+
+
+class FragmentCacheExtension(Extension):
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        # A VersionedCache, fragments render every time while unset
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render',
+                                                [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        name = 'fragment:' + ':'.join(unicode(part) for part in key)
+        return cache.get_or_create(name, caller)
+
+
+def init_app(app, cache):
+    """
+    Turns on bytecode caching and {% cache %} fragments (stored in cache),
+    must run before the app's Jinja environment is first used.
+    """
+    cache_dir = app.config.setdefault(
+                    'TEMPLATE_CACHE_DIR',
+                    os.path.join(tempfile.gettempdir(), 'catalog-jinja'))
+    options = dict(app.jinja_options)
+    options['extensions'] = list(options.get('extensions', [])) + \
+        [FragmentCacheExtension]
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Already there (e.g. made by another worker)
+            if not os.path.isdir(cache_dir):
+                raise
+        options['bytecode_cache'] = FileSystemBytecodeCache(cache_dir)
+    app.jinja_options = options
+
+    app.jinja_env.fragment_cache = cache
@@ -0,0 +1,172 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Google OAuth2 HTTP client for gconnect/gdisconnect:
+    - one keep-alive connection pool per process (requests.Session), with
+      timeouts on every call
+    - a keep-alive httplib2.Http per thread for oauth2client's code
+      exchange (httplib2 connections can't be shared between threads)
+    - tokeninfo and userinfo fetched concurrently
+    - ID tokens verified locally against Google's certs, which are cached
+      for as long as Google's Cache-Control allows
+Every URL is configurable (GOOGLE_*), e.g. to run against a local stub
+OAuth server.
+"""
+
+import re
+import time
+import threading
+
+import httplib2
+import requests
+
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from oauth2client import crypt
+
+DEFAULTS = {
+    # None keeps the token_uri of client_secrets.json
+    'GOOGLE_TOKEN_URI': None,
+    'GOOGLE_TOKENINFO_URL': 'https://www.googleapis.com/oauth2/v1/tokeninfo',
+    'GOOGLE_USERINFO_URL': 'https://www.googleapis.com/oauth2/v1/userinfo',
+    'GOOGLE_REVOKE_URL': 'https://accounts.google.com/o/oauth2/revoke',
+    'GOOGLE_CERTS_URL': 'https://www.googleapis.com/oauth2/v1/certs',
+    'GOOGLE_ISSUERS': ('accounts.google.com', 'https://accounts.google.com'),
+    # Seconds to connect / to wait for a response
+    'GOOGLE_HTTP_TIMEOUT': (3.05, 10),
+    # Pooled connections kept per host
+    'GOOGLE_HTTP_POOL': 10
+}
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleAuthError(Exception):
+    # Google could not be reached, or answered with an error / bad token
+    pass
+
+
+class GoogleAuth(object):
+    def __init__(self, client_id, config):
+        self.client_id = client_id
+        self.config = config
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pool = None
+        self.certs = None
+        self.certs_expire = 0
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config['GOOGLE_HTTP_POOL'],
+                              pool_maxsize=config['GOOGLE_HTTP_POOL'])
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+    def _get(self, url, **params):
+        try:
+            response = self.http.get(url, params=params,
+                                     timeout=self.config[
+                                                'GOOGLE_HTTP_TIMEOUT'])
+        except requests.RequestException as e:
+            raise GoogleAuthError("GET %s failed: %s" % (url, e))
+        return response
+
+    def _getJSON(self, url, **params):
+        response = self._get(url, **params)
+        try:
+            return response.json()
+        except ValueError:
+            raise GoogleAuthError("GET %s returned %d, not JSON" %
+                                  (url, response.status_code))
+
+    def _threads(self):
+        # Created on first use, so never inherited across a fork
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(4)
+            return self.pool
+
+    def exchangeHttp(self):
+        # This thread's keep-alive httplib2.Http, for oauth2client calls
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            timeout = self.config['GOOGLE_HTTP_TIMEOUT']
+            if isinstance(timeout, tuple):
+                timeout = max(timeout)
+            http = self.local.http = httplib2.Http(timeout=timeout)
+        return http
+
+    def exchange(self, flow, code):
+        """
+        Upgrades an authorization code into credentials, raises
+        oauth2client's FlowExchangeError if Google refuses it.
+        """
+        if self.config['GOOGLE_TOKEN_URI']:
+            flow.token_uri = self.config['GOOGLE_TOKEN_URI']
+        try:
+            return flow.step2_exchange(code, http=self.exchangeHttp())
+        except (httplib2.HttpLib2Error, IOError) as e:
+            # Connection errors, drop the (possibly broken) connection
+            self.local.http = None
+            raise GoogleAuthError("Code exchange failed: %s" % e)
+
+    def profile(self, access_token):
+        """
+        Returns (tokeninfo, userinfo) for the access token, both requested
+        at once.
+        """
+        threads = self._threads()
+        tokeninfo = threads.apply_async(
+                    self._getJSON, (self.config['GOOGLE_TOKENINFO_URL'],),
+                    {'access_token': access_token})
+        userinfo = threads.apply_async(
+                    self._getJSON, (self.config['GOOGLE_USERINFO_URL'],),
+                    {'access_token': access_token, 'alt': 'json'})
+        return tokeninfo.get(), userinfo.get()
+
+    def _certs(self):
+        # Google's signing certs, refetched once Cache-Control says so
+        with self.lock:
+            if self.certs is not None and time.time() < self.certs_expire:
+                return self.certs
+
+        response = self._get(self.config['GOOGLE_CERTS_URL'])
+        try:
+            certs = response.json()
+        except ValueError:
+            raise GoogleAuthError("Could not load Google's certs")
+        match = MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        with self.lock:
+            self.certs = certs
+            self.certs_expire = time.time() + \
+                (int(match.group(1)) if match else 0)
+        return certs
+
+    def verifyIdToken(self, id_token):
+        """
+        Checks the ID token's signature, audience (our client id), expiry
+        and issuer without calling Google, returns its payload.
+        """
+        try:
+            payload = crypt.verify_signed_jwt_with_certs(
+                                id_token, self._certs(), self.client_id)
+        except crypt.AppIdentityError as e:
+            raise GoogleAuthError("Invalid ID token: %s" % e)
+        if payload.get('iss') not in self.config['GOOGLE_ISSUERS']:
+            raise GoogleAuthError("Invalid ID token issuer")
+        return payload
+
+    def revoke(self, access_token):
+        # Returns the HTTP status of the revocation request
+        return self._get(self.config['GOOGLE_REVOKE_URL'],
+                         token=access_token).status_code
+
+
+def init_app(app, client_id):
+    """
+    Sets the GOOGLE_* config defaults, returns the app's GoogleAuth.
+    """
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    return GoogleAuth(client_id, app.config)
@@ -0,0 +1,42 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Gunicorn settings for the Catalog App:
+    gunicorn -c gunicorn.conf.py wsgi:application
+Pre-forked worker processes, each serving requests on a pool of threads.
+'kill -HUP <master pid>' replaces the workers one set at a time, new ones
+are serving before the old ones finish their requests and exit, so code
+and config changes deploy without dropping requests.
+"""
+
+import os
+import sys
+import multiprocessing
+
+bind = os.environ.get('CATALOG_BIND', '0.0.0.0:9090')
+workers = int(os.environ.get('CATALOG_WORKERS',
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('CATALOG_THREADS', 4))
+worker_class = 'gthread'
+# Keep below the database pool (DATABASE_POOL pool_size + max_overflow)
+# per worker: each thread holds at most one connection
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Loading the app in the master saves memory and worker start time, but
+# HUP then only restarts workers with the code the master loaded
+preload_app = os.environ.get('CATALOG_PRELOAD', '') == '1'
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # A preloaded app's engine may hold connections opened in the master,
+    # sockets shared across processes corrupt each other. Start every
+    # worker with an empty pool.
+    catalog = sys.modules.get('catalog')
+    if catalog is not None:
+        for engine in [catalog.engine] + catalog.replicas:
+            engine.dispose()
@@ -0,0 +1,179 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Request / SQL instrumentation (opt-in, INSTRUMENTATION app config):
+    - per request SQL statement count, total DB time, slowest statement
+      and template render time, sent back as a Server-Timing header
+    - per endpoint aggregates and latency histograms at /debug/metrics
+"""
+
+import time
+import threading
+
+from flask import g, request, jsonify, abort, has_request_context
+from flask import signals_available, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Upper bounds (ms) of the latency histogram buckets, plus an overflow one
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.render_ms = 0.0
+        self.statements = 0
+        self.max_statements = 0
+        self.slowest_ms = 0.0
+        self.slowest_sql = None
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, total_ms, db_ms, render_ms, statements, slowest_ms,
+            slowest_sql):
+        self.requests += 1
+        self.total_ms += total_ms
+        self.db_ms += db_ms
+        self.render_ms += render_ms
+        self.statements += statements
+        self.max_statements = max(self.max_statements, statements)
+        if slowest_ms > self.slowest_ms:
+            self.slowest_ms = slowest_ms
+            self.slowest_sql = slowest_sql
+
+        for i, bound in enumerate(BUCKETS):
+            if total_ms <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.histogram[i] += 1
+
+    def asdict(self):
+        requests = self.requests or 1
+        buckets = ['<=%d' % bound for bound in BUCKETS] + \
+                  ['>%d' % BUCKETS[-1]]
+        return {
+            'requests': self.requests,
+            'avg_ms': round(self.total_ms / requests, 3),
+            'avg_db_ms': round(self.db_ms / requests, 3),
+            'avg_render_ms': round(self.render_ms / requests, 3),
+            'avg_statements': round(float(self.statements) / requests, 3),
+            'max_statements': self.max_statements,
+            'slowest_statement_ms': round(self.slowest_ms, 3),
+            'slowest_statement': self.slowest_sql,
+            'histogram_ms': [[bucket, count] for bucket, count
+                             in zip(buckets, self.histogram)]
+        }
+
+
+class Metrics(object):
+    # Process-local aggregates, one EndpointStats per endpoint
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, *args):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.add(*args)
+
+    def snapshot(self):
+        with self.lock:
+            return dict((endpoint, stats.asdict())
+                        for endpoint, stats in self.endpoints.items())
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+metrics = Metrics()
+
+
+def _tracing():
+    return has_request_context() and 'timing' in g
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    if _tracing():
+        conn.info.setdefault('query_start', []).append(time.time())
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    if _tracing() and conn.info.get('query_start'):
+        elapsed = (time.time() - conn.info['query_start'].pop()) * 1000
+        timing = g.timing
+        timing['statements'] += 1
+        timing['db_ms'] += elapsed
+        if elapsed > timing['slowest_ms']:
+            timing['slowest_ms'] = elapsed
+            timing['slowest_sql'] = statement[:200]
+
+
+def _before_render(sender, template, context, **extra):
+    if _tracing():
+        g.timing['render_start'] = time.time()
+
+
+def _after_render(sender, template, context, **extra):
+    if _tracing() and g.timing.get('render_start'):
+        g.timing['render_ms'] += \
+            (time.time() - g.timing.pop('render_start')) * 1000
+
+
+def init_app(app, engine, replicas=()):
+    """
+    Registers the instrumentation hooks on the app, engine and any read
+    replica engines. They are no-ops unless app.config['INSTRUMENTATION']
+    is True.
+    """
+    app.config.setdefault('INSTRUMENTATION', False)
+
+    for traced in [engine] + list(replicas):
+        event.listen(traced, 'before_cursor_execute', _before_execute)
+        event.listen(traced, 'after_cursor_execute', _after_execute)
+    # Render timing needs blinker for Flask's signals
+    if signals_available:
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def startTiming():
+        if app.config['INSTRUMENTATION']:
+            g.timing = {'start': time.time(), 'statements': 0,
+                        'db_ms': 0.0, 'slowest_ms': 0.0,
+                        'slowest_sql': None, 'render_ms': 0.0}
+
+    @app.after_request
+    def finishTiming(response):
+        # Streamed bodies are produced after this point, only the work done
+        # before the first byte is counted for them
+        timing = g.get('timing')
+        if timing is None:
+            return response
+
+        total_ms = (time.time() - timing['start']) * 1000
+        response.headers['Server-Timing'] = ', '.join([
+            'db;dur=%.3f;desc="%d statements"' % (timing['db_ms'],
+                                                  timing['statements']),
+            'db-slowest;dur=%.3f' % timing['slowest_ms'],
+            'render;dur=%.3f' % timing['render_ms'],
+            'total;dur=%.3f' % total_ms])
+
+        metrics.record(request.endpoint or '<unmatched>', total_ms,
+                       timing['db_ms'], timing['render_ms'],
+                       timing['statements'], timing['slowest_ms'],
+                       timing['slowest_sql'])
+        return response
+
+    @app.route('/debug/metrics')
+    def debugMetrics():
+        if not app.config['INSTRUMENTATION']:
+            abort(404)
+        return jsonify(Metrics=metrics.snapshot())
@@ -0,0 +1,127 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Structured logging for the Catalog App:
+    - one JSON object per line (timestamp, level, logger, message,
+      request id and any 'extra' fields)
+    - per logger levels, e.g. 'catalog' for the HTML routes and
+      'catalog.api' for the JSON endpoints
+    - sampling of DEBUG/INFO records for high traffic loggers
+    - a request id per request, taken from X-Request-ID or generated, and
+      sent back in the response
+
+Configured from app.config (LOG_LEVELS, LOG_SAMPLING) or the environment:
+    CATALOG_LOG_LEVELS="catalog=DEBUG,catalog.api=INFO"
+    CATALOG_LOG_SAMPLING="catalog.api=0.01"
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+
+from flask import g, request, has_request_context
+
+# Attributes every LogRecord has, anything else came in via extra={...}
+_RECORD_ATTRS = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__)
+_RECORD_ATTRS.update(('message', 'asctime', 'request_id'))
+
+
+class RequestIdFilter(logging.Filter):
+    # Tags records logged while handling a request with its id
+    def filter(self, record):
+        record.request_id = None
+        if has_request_context():
+            record.request_id = g.get('request_id')
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the DEBUG/INFO records of the configured
+    loggers (and their children), WARNING and above always pass.
+    """
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = rates
+
+    def rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rate(record.name)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        ts = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+        entry = {
+            'ts': '%s.%03dZ' % (ts, record.msecs),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _parse(setting, convert):
+    # "name=value,name=value" -> {name: convert(value)}
+    parsed = {}
+    for part in setting.split(','):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            parsed[name.strip()] = convert(value.strip())
+    return parsed
+
+
+def init_app(app):
+    """
+    Sets up JSON line logging to stderr for the 'catalog' loggers and the
+    request id hooks. Tracing (DEBUG) is off unless a level enables it.
+    """
+    levels = {'catalog': 'INFO'}
+    levels.update(app.config.get('LOG_LEVELS', {}))
+    levels.update(_parse(os.environ.get('CATALOG_LOG_LEVELS', ''),
+                         str.upper))
+    sampling = dict(app.config.get('LOG_SAMPLING', {}))
+    sampling.update(_parse(os.environ.get('CATALOG_LOG_SAMPLING', ''),
+                           float))
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    handler.addFilter(RequestIdFilter())
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger('catalog')
+    root.handlers = [handler]
+    root.propagate = False
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    @app.before_request
+    def assignRequestId():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or \
+                       uuid.uuid4().hex
+
+    @app.after_request
+    def sendRequestId(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
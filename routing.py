@@ -0,0 +1,55 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Read replica routing for the Catalog App's ORM Sessions:
+    - reads go to a replica, one per Session (picked at random), so a
+      request sees a single consistent replica
+    - flushes, INSERT/UPDATE/DELETE statements and bare connection() calls
+      (e.g. bulk.py) go to the primary, as does everything the Session
+      reads after its first write
+    - use_primary() (e.g. non-GET requests, or a user who just committed)
+      and primary() blocks send reads to the primary as well
+With no replicas configured every statement goes to the primary.
+"""
+
+import random
+import contextlib
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class RoutingSession(Session):
+    def __init__(self, replicas=(), use_primary=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = list(replicas)
+        self.use_primary = use_primary
+        self.primary_depth = 0
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super(RoutingSession, self).get_bind(mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase) or \
+                (mapper is None and clause is None):
+            # Read-your-writes for the rest of this Session
+            self.info['wrote'] = True
+            return primary
+        if not self.replicas or self.info.get('wrote') or \
+                self.primary_depth or \
+                (self.use_primary is not None and self.use_primary()):
+            return primary
+
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = self.info['replica'] = random.choice(self.replicas)
+        return replica
+
+    @contextlib.contextmanager
+    def primary(self):
+        # Reads inside the block go to the primary, e.g. to fill a cache
+        # that outlives replication lag
+        self.primary_depth += 1
+        try:
+            yield self
+        finally:
+            self.primary_depth -= 1
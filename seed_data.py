@@ -0,0 +1,166 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Synthetic data generator, for testing/benchmarking at realistic sizes:
+    - N users (google login, 'contrib' role, the first one also 'admin')
+    - M categories
+    - K items per category on average, spread over the categories with a
+      Zipf-like skew (a few huge categories, a long tail of small ones)
+    - item creation times spread over the last --days days
+
+Usage:
+    python seed_data.py --users 1000 --categories 200 --items 250
+Set CATALOG_DATABASE_URL to seed a database other than DATABASE.
+"""
+
+import sys
+import random
+import argparse
+import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from database_setup import (Category, Item, User, LoginType, Role,
+                            user_role_association, getEngine,
+                            refreshItemCounts, recordBulkActivity,
+                            logBulkChanges, ACTIVITY_SIZE)
+
+BATCH_SIZE = 5000
+
+
+def getOrCreate(session, model, **values):
+    instance = session.query(model).filter_by(**values).first()
+    if instance is None:
+        instance = model(**values)
+        session.add(instance)
+        session.flush()
+    return instance
+
+
+def skewedCounts(total, buckets, skew, rnd):
+    """
+    Splits total into buckets counts, bucket i weighted 1 / (i + 1) ** skew
+    (skew 0: uniform). Bucket order is shuffled so ids don't give it away.
+    """
+    weights = [1.0 / (i + 1) ** skew for i in range(buckets)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    # Hand out what rounding dropped, heaviest buckets first
+    for i in range(total - sum(counts)):
+        counts[i % buckets] += 1
+    rnd.shuffle(counts)
+    return counts
+
+
+def insertBatches(session, table, rows):
+    # rows is any iterable of dicts, executemany'd BATCH_SIZE at a time
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            session.execute(insert(table), batch)
+            batch = []
+    if batch:
+        session.execute(insert(table), batch)
+
+
+def seed(session, users, categories, items, skew=1.1, days=365,
+         seed=None):
+    """
+    Adds the synthetic users, categories and items, the caller commits.
+    Names carry a run tag so repeated runs don't collide on unique keys.
+    Returns the number of (users, categories, items) added.
+    """
+    rnd = random.Random(seed)
+    tag = '%06x' % rnd.getrandbits(24)
+    now = datetime.datetime.utcnow()
+
+    logintype = getOrCreate(session, LoginType, source='google')
+    admin = getOrCreate(session, Role, permission='admin')
+    contrib = getOrCreate(session, Role, permission='contrib')
+
+    insertBatches(session, User.__table__, (
+        {'name': 'Seed User %d' % i, 'email': 'seed-%s-%d@example.com' %
+         (tag, i), 'logintype_id': logintype.id}
+        for i in range(users)))
+    user_ids = [user_id for user_id, in session.query(User.id).filter(
+                User.email.like('seed-%s-%%' % tag)).order_by(User.id)]
+    insertBatches(session, user_role_association, (
+        {'user_id': user_id, 'role_id': contrib.id}
+        for user_id in user_ids))
+    if user_ids:
+        session.execute(insert(user_role_association),
+                        {'user_id': user_ids[0], 'role_id': admin.id})
+    # Activity is skewed too, a few users create most of the content
+    authors = user_ids or [None]
+    author_weights = skewedCounts(len(authors) * 10, len(authors), skew,
+                                  rnd)
+    authors = [author for author, weight in zip(authors, author_weights)
+               for _ in range(weight)] or authors
+
+    insertBatches(session, Category.__table__, (
+        {'name': 'Category %s-%d' % (tag, i),
+         'description': 'Synthetic category %d' % i,
+         'created_by': rnd.choice(authors)}
+        for i in range(categories)))
+    categ_ids = [categ_id for categ_id, in session.query(Category.id).filter(
+                 Category.name.like('Category %s-%%' % tag)).order_by(
+                 Category.id)]
+
+    counts = skewedCounts(items * len(categ_ids), len(categ_ids), skew, rnd) \
+        if categ_ids else []
+
+    def itemRows():
+        for categ_id, count in zip(categ_ids, counts):
+            for i in range(count):
+                age = datetime.timedelta(seconds=rnd.randint(0,
+                                                             days * 86400))
+                yield {'name': 'Item %d' % i,
+                       'description': 'Synthetic item %d of category %d' %
+                                      (i, categ_id),
+                       'category_id': categ_id,
+                       'created_by': rnd.choice(authors),
+                       'created': now - age}
+
+    insertBatches(session, Item.__table__, itemRows())
+    connection = session.connection()
+    # Also logs the categories as changed for sync clients
+    refreshItemCounts(connection, categ_ids)
+    if categ_ids:
+        logBulkChanges(connection, 'item', 'upsert',
+                       Item.category_id.in_(categ_ids))
+        # Only the newest items fit the activity feed anyway
+        recordBulkActivity(connection, 'create',
+                           Item.category_id.in_(categ_ids),
+                           limit=ACTIVITY_SIZE)
+    return len(user_ids), len(categ_ids), sum(counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed synthetic data")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--items', type=int, default=100,
+                        help="average items per category")
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help="Zipf exponent of the distributions, 0 for "
+                             "uniform")
+    parser.add_argument('--days', type=int, default=365,
+                        help="item creation times spread over this many "
+                             "days")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    engine = getEngine()
+    session = sessionmaker(bind=engine)()
+    counts = seed(session, args.users, args.categories, args.items,
+                  args.skew, args.days, args.seed)
+    session.commit()
+    print "Added %d users, %d categories and %d items" % counts
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+Server-side login sessions, the cookie only carries an opaque session id:
+    - SessionStore, the storage interface
+    - MemorySessionStore, process-local LRU (single process/development)
+    - SQLSessionStore, the login_session table (shared by every worker)
+    - ServerSessionInterface, the Flask SessionInterface using a store
+Records expire PERMANENT_SESSION_LIFETIME after their last change and are
+swept every SESSION_SWEEP_INTERVAL seconds. Static files never load a
+session.
+"""
+
+import os
+import time
+import base64
+import datetime
+import threading
+
+from flask.sessions import (SessionInterface, SessionMixin,
+                            session_json_serializer)
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+
+
+class SessionStore(object):
+    # Session records are JSON strings (flask's tagged serializer)
+    def load(self, sid):
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self):
+        # Removes expired records, returns how many
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxsize=10000):
+        self.records = LRUCache(maxsize, ttl=None)
+
+    def load(self, sid):
+        return self.records.get(sid)
+
+    def save(self, sid, data, expires):
+        self.records.set(sid, data, max(expires - time.time(), 1))
+
+    def delete(self, sid):
+        self.records.delete(sid)
+
+    def sweep(self):
+        return self.records.purge()
+
+
+class SQLSessionStore(SessionStore):
+    # Each call runs in its own short transaction, apart from the request's
+    # ORM Session
+    def __init__(self, engine, table):
+        self.engine = engine
+        self.table = table
+
+    def load(self, sid):
+        table = self.table
+        with self.engine.connect() as conn:
+            return conn.execute(select([table.c.data]).where(
+                        (table.c.sid == sid) &
+                        (table.c.expires > datetime.datetime.utcnow()))
+                        ).scalar()
+
+    def save(self, sid, data, expires):
+        table = self.table
+        expires = datetime.datetime.utcfromtimestamp(expires)
+        with self.engine.begin() as conn:
+            updated = conn.execute(table.update().where(
+                        table.c.sid == sid).values(data=data,
+                                                   expires=expires))
+            if not updated.rowcount:
+                conn.execute(table.insert().values(sid=sid, data=data,
+                                                   expires=expires))
+
+    def delete(self, sid):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def sweep(self):
+        table = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(table.delete().where(
+                        table.c.expires <= datetime.datetime.utcnow())
+                        ).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store, sweep_interval=600):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.next_sweep = 0
+        self.lock = threading.Lock()
+
+    def newSid(self):
+        return base64.urlsafe_b64encode(os.urandom(24))
+
+    def sweep(self):
+        # At most one sweep per interval per process, by whichever request
+        # gets here first
+        with self.lock:
+            if time.time() < self.next_sweep:
+                return
+            self.next_sweep = time.time() + self.sweep_interval
+        self.store.sweep()
+
+    def open_session(self, app, request):
+        if app.static_url_path and \
+                request.path.startswith(app.static_url_path + '/'):
+            return self.make_null_session(app)
+
+        self.sweep()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                try:
+                    return ServerSession(self.serializer.loads(data), sid)
+                except ValueError:
+                    pass
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        if not session.modified and not session.new:
+            return
+
+        if session.sid is None:
+            session.sid = self.newSid()
+        lifetime = app.permanent_session_lifetime
+        expires = time.time() + lifetime.days * 86400 + lifetime.seconds
+        self.store.save(session.sid, self.serializer.dumps(dict(session)),
+                        expires)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app))
+
+
+def init_app(app, engine, table):
+    """
+    Installs server-side sessions, SESSION_BACKEND (or the
+    CATALOG_SESSION_BACKEND environment variable) 'sql' (default), 'memory'
+    or 'cookie' (Flask's signed cookie sessions, unchanged).
+    """
+    app.config.setdefault('SESSION_BACKEND',
+                          os.environ.get('CATALOG_SESSION_BACKEND', 'sql'))
+    app.config.setdefault('SESSION_SWEEP_INTERVAL', 600)
+    app.config.setdefault('SESSION_MEMORY_MAXSIZE', 10000)
+
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return None
+    if backend == 'memory':
+        store = MemorySessionStore(app.config['SESSION_MEMORY_MAXSIZE'])
+    elif backend == 'sql':
+        store = SQLSessionStore(engine, table)
+    else:
+        raise ValueError("Unknown SESSION_BACKEND %r" % backend)
+
+    app.session_interface = ServerSessionInterface(
+                    store, app.config['SESSION_SWEEP_INTERVAL'])
+    return store
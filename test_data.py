@@ -7,14 +7,12 @@ Test data population script
     - ver: 0.1  05/2017
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.engine.url import URL
 from sqlalchemy.orm import sessionmaker
 
 from database_setup import (Base, Category, Item, User, LoginType, Role, 
-                            DATABASE)
+                            getEngine)
 
-engine = create_engine(URL(**DATABASE))
+engine = getEngine()
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
 session = DBSession()
@@ -0,0 +1,11 @@
+"""
+Nathan D. Hernandez
+Udacity FullStack NanoDegree
+
+WSGI entry point of the Catalog App, e.g.:
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+
+from catalog import create_app
+
+application = create_app()